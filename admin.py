@@ -0,0 +1,294 @@
+# Admin tools
+# Bulk maintenance without going through Discord. Run it while the bot is stopped (or restart the
+# bot afterwards), the bot keeps guilds, settings and scores in memory.
+#
+#   python admin.py export users users.csv
+#   python admin.py import users users.csv --on-conflict replace
+#   python admin.py reverify              # report only
+#   python admin.py reverify --apply      # also add the completions that were never credited
+#
+# Tables: users (user_data), guilds (guild_data), challenges (challenge_data). Files are CSV with a
+# header row; on import only the columns present are written, the key columns are required (a challenges
+# file without guild, the shape challenge_data had before per-guild sets, is the shared set's). An empty
+# score or lastChallengeDate cell is left out too, so new rows get the table default and existing rows
+# keep their value.
+# Rows are written in batches with executemany, one transaction per batch.
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import datetime
+import json
+import sys
+import typing
+
+from cf_api import CodeforcesClient, CF_API_BASE, PRIORITY_BACKGROUND
+from challenges import may_complete, migrate as migrate_challenges, scope_members, SCHEMA as CHALLENGES_SCHEMA
+from database import Database
+from guild_settings import DEFAULT_SCOPE
+from leaderboard import SCHEMA as LEADERBOARD_SCHEMA
+from ledger import Completion, ScoreLedger, append as append_completions, sync_legacy_scores, SCHEMA as LEDGER_SCHEMA
+from problemset import JSONArrayStream
+from scoring import get_scoring
+
+class Table(typing.NamedTuple):
+    name : str
+    columns : tuple[str, ...]
+    keys : tuple[str, ...] # Primary key columns
+    defaulted : tuple[str, ...] = () # Columns left out of a row when its cell is empty, the bot can't handle NULLs in them
+    implied : tuple[tuple[str, str], ...] = () # (key column, value) used when a file has no such column
+
+TABLES = {
+    "users": Table("user_data", ("userID", "codeforcesHandle", "score", "lastChallengeDate"), ("userID",), ("score", "lastChallengeDate")),
+    "guilds": Table("guild_data", ("guild", "challenge_channel"), ("guild",)),
+    "challenges": Table("challenge_data", ("date", "guild", "rating", "problemIndex", "problemContestID"), ("date", "guild", "rating"), implied=(("guild", str(DEFAULT_SCOPE)),)),
+}
+
+async def open_db(path : str) -> Database:
+    db = Database(path, readers=1)
+    await db.open(schema=[CHALLENGES_SCHEMA, *LEADERBOARD_SCHEMA, *LEDGER_SCHEMA])
+    async with db.transaction() as conn:
+        await migrate_challenges(conn)
+    return db
+
+# Export
+
+async def export_table(db : Database, table : Table, out : typing.TextIO, batch : int) -> int:
+    writer = csv.writer(out)
+    writer.writerow(table.columns)
+    count = 0
+    async with db.read() as conn:
+        async with conn.execute(f"SELECT {', '.join(table.columns)} FROM {table.name} ORDER BY {', '.join(table.keys)}") as cursor:
+            while rows := await cursor.fetchmany(batch):
+                writer.writerows(rows)
+                count += len(rows)
+    return count
+
+# Import
+
+def insert_statement(table : Table, columns : list[str], on_conflict : str) -> str:
+    placeholders = ", ".join("?" * len(columns))
+    if on_conflict == "skip":
+        return f"INSERT OR IGNORE INTO {table.name}({', '.join(columns)}) VALUES({placeholders})"
+    updates = [column for column in columns if column not in table.keys]
+    if not updates:
+        return f"INSERT OR IGNORE INTO {table.name}({', '.join(columns)}) VALUES({placeholders})"
+    return (f"INSERT INTO {table.name}({', '.join(columns)}) VALUES({placeholders}) "
+            f"ON CONFLICT({', '.join(table.keys)}) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in updates)}")
+
+async def import_table(db : Database, table : Table, source : typing.TextIO, batch : int, on_conflict : str) -> int:
+    reader = csv.reader(source)
+    header = next(reader, None)
+    if header is None:
+        return 0
+    header = [column.strip() for column in header]
+    implied = [(column, value) for column, value in table.implied if column not in header]
+    header += [column for column, value in implied]
+    unknown = [column for column in header if column not in table.columns]
+    missing = [column for column in table.keys if column not in header]
+    if unknown or missing:
+        raise ValueError(f"{table.name}: unknown columns {unknown}, missing key columns {missing}")
+
+    count = 0
+    batches = {} # Columns written to the rows (which depends on their empty cells)
+    for row in reader:
+        if not row:
+            continue
+        row += [value for column, value in implied]
+        cells = [(column, value) for column, value in zip(header, row) if value != "" or column not in table.defaulted]
+        columns = tuple(column for column, value in cells)
+        rows = batches.setdefault(columns, [])
+        rows.append([value if value != "" else None for column, value in cells]) # Column affinity turns numbers back into INTEGERs
+        if len(rows) >= batch:
+            count += await db.executemany(insert_statement(table, list(columns), on_conflict), rows)
+            rows.clear()
+    for columns, rows in batches.items():
+        if rows:
+            count += await db.executemany(insert_statement(table, list(columns), on_conflict), rows)
+
+    if table.name == "user_data":
+        # Imported scores have no history in the ledger, they become the users' legacy scores
+        async with db.transaction() as conn:
+            await sync_legacy_scores(conn)
+    return count
+
+# Re-verification
+
+class Report:
+    def __init__(self):
+        self.handles = 0
+        self.failed = [] # Handles whose submissions couldn't be fetched
+        self.verified = 0 # Ledger completions backed by an accepted submission
+        self.unverified = [] # (userID, handle, date, rating) in the ledger without one
+        self.missing = {} # userID to {date: (Completion, points)} solved but never credited
+
+# Reads every accepted submission of a user.status response, keeping (contestId, index, time, id)
+async def parse_accepted(resp):
+    stream = JSONArrayStream(resp.content)
+    if not await stream.seek_array("result"):
+        return json.loads(stream.head + stream.buffer[stream.pos:])
+    accepted = []
+    async for sub in stream.items():
+        if sub.get("verdict") == "OK":
+            problem = sub["problem"]
+            accepted.append((problem.get("contestId"), problem["index"], sub["creationTimeSeconds"], sub["id"]))
+    return accepted
+
+async def reverify(db : Database, client : CodeforcesClient, since : datetime.date | None, concurrency : int) -> Report:
+    # (contestId, index) to [(date, scope, rating)] of every challenge it was in
+    challenges = {}
+    for date, scope, rating, contestId, index in await db.fetchall("SELECT date, guild, rating, problemContestID, problemIndex FROM challenge_data WHERE date >= ?", ((since or datetime.date.min).isoformat(),)):
+        challenges.setdefault((contestId, index), []).append((datetime.date.fromisoformat(date), int(scope), rating))
+    members = await scope_members(db, {scope for entries in challenges.values() for date, scope, rating in entries})
+
+    credited = {} # userID to {date: (guild, rating)}
+    for userID, date, guild, rating in await db.fetchall("SELECT userID, date, guild, rating FROM challenge_completions WHERE date >= ?", ((since or datetime.date.min).isoformat(),)):
+        credited.setdefault(userID, {})[datetime.date.fromisoformat(date)] = (guild, rating)
+
+    users = await db.fetchall("SELECT userID, codeforcesHandle FROM user_data WHERE codeforcesHandle IS NOT NULL")
+    report = Report()
+    report.handles = len(users)
+    semaphore = asyncio.Semaphore(concurrency) # Limits the responses held in memory, the client limits the rate
+
+    async def check(userID, handle):
+        try:
+            async with semaphore:
+                result, headers = await client.request_conditional("user.status", {"handle": handle}, {}, PRIORITY_BACKGROUND, parse_accepted)
+        except Exception as e: # Network error or a broken payload, the other handles still get checked
+            print(f"Error (REVERIFY): {handle}: {e!r}", file=sys.stderr)
+            result = None
+        if not isinstance(result, list):
+            report.failed.append(handle)
+            return
+
+        # One pass over the user's accepted submissions: every challenge (date, scope, rating) they solved
+        solved = {} # (date, scope, rating) to submission id
+        for contestId, index, submitted, submissionId in result:
+            for date, scope, rating in challenges.get((contestId, index), ()):
+                # A solve counts while the challenge was current: guilds' dates run up to a day ahead of (or behind) UTC,
+                # so from the day before the challenge date to the day after it
+                if abs(datetime.datetime.fromtimestamp(submitted, datetime.timezone.utc).date() - date) <= datetime.timedelta(days=1):
+                    solved.setdefault((date, scope, rating), submissionId)
+
+        user_credited = credited.get(userID, {})
+        for date, (guild, rating) in user_credited.items():
+            # The guild's own set if it had one that day, otherwise the shared one
+            if (date, guild, rating) in solved or (date, DEFAULT_SCOPE, rating) in solved:
+                report.verified += 1
+            else:
+                report.unverified.append((userID, handle, date, rating))
+
+        best = {} # Uncredited date to the highest rated solve of a set the user could have completed
+        for (date, scope, rating), submissionId in solved.items():
+            if date not in user_credited and may_complete(scope, userID, members) and (date not in best or rating > best[date].rating):
+                best[date] = Completion(rating, scope, submissionId)
+        if best:
+            report.missing[userID] = {date: (completion, get_scoring(completion.rating)) for date, completion in best.items()}
+
+    done = 0
+    for task in asyncio.as_completed([check(userID, handle) for userID, handle in users]):
+        await task
+        done += 1
+        if done % 50 == 0 or done == len(users):
+            print(f"Checked {done}/{len(users)} handles", file=sys.stderr)
+    return report
+
+# Adds the missing completions to the ledger. Points of completions from before the ledger are usually
+# part of the user's legacy score already, so they are moved out of it rather than added twice. Later
+# completions add to the score.
+async def apply_missing(db : Database, missing : dict[int, dict]) -> int:
+    added = 0
+    by_date = {}
+    for userID, completions in missing.items():
+        for date, credit in completions.items():
+            by_date.setdefault(date, {})[userID] = credit
+
+    async with db.transaction() as conn:
+        # Completions credited since the ledger exists are all in it, only older ones can be in a legacy score
+        async with conn.execute("SELECT MIN(date) FROM challenge_completions") as cursor:
+            first = (await cursor.fetchone())[0]
+        ledger_start = datetime.date.fromisoformat(first) if first is not None else datetime.date.max
+
+        appended_points = {}
+        legacy_points = {}
+        for date, credits in sorted(by_date.items()):
+            appended = await append_completions(conn, date, credits)
+            added += len(appended)
+            for userID, points in appended.items():
+                appended_points[userID] = appended_points.get(userID, 0) + points
+                if date < ledger_start:
+                    legacy_points[userID] = legacy_points.get(userID, 0) + points
+        await conn.executemany("UPDATE user_stats SET legacyScore = MAX(0, legacyScore - ?) WHERE userID = ?", [(points, userID) for userID, points in legacy_points.items()])
+        await conn.executemany("UPDATE user_data SET lastChallengeDate = MAX(COALESCE(lastChallengeDate, ''), ?) WHERE userID = ?",
+                               [(max(missing[userID]).isoformat(), userID) for userID in appended_points])
+
+    # Completions were appended out of date order, so streaks and scores are recomputed
+    await ScoreLedger(db).rebuild()
+    return added
+
+# Command line
+
+async def run(args):
+    db = await open_db(args.db)
+    try:
+        if args.command == "export":
+            table = TABLES[args.table]
+            with (open(args.file, "w", newline="", encoding="utf-8") if args.file != "-" else contextlib.nullcontext(sys.stdout)) as out:
+                count = await export_table(db, table, out, args.batch)
+            print(f"Exported {count} rows of {table.name}", file=sys.stderr)
+
+        elif args.command == "import":
+            table = TABLES[args.table]
+            with (open(args.file, newline="", encoding="utf-8") if args.file != "-" else contextlib.nullcontext(sys.stdin)) as source:
+                try:
+                    count = await import_table(db, table, source, args.batch, args.on_conflict)
+                except ValueError as e:
+                    print(f"Error (IMPORT): {e}", file=sys.stderr)
+                    return 1
+            print(f"Imported {count} rows into {table.name}", file=sys.stderr)
+
+        elif args.command == "reverify":
+            client = CodeforcesClient(args.api, rate=args.rate, burst=1)
+            try:
+                report = await reverify(db, client, args.since, args.concurrency)
+            finally:
+                await client.close()
+
+            print(f"{report.handles} handles, {len(report.failed)} could not be fetched")
+            print(f"{report.verified} credited completions verified, {len(report.unverified)} without an accepted submission")
+            for userID, handle, date, rating in report.unverified:
+                print(f"  unverified: {userID} ({handle}) {date.isoformat()} {rating}")
+            missing_count = sum(len(completions) for completions in report.missing.values())
+            print(f"{missing_count} solved challenges were never credited")
+            if args.apply and missing_count:
+                added = await apply_missing(db, report.missing)
+                print(f"Credited {added} completions")
+    finally:
+        await db.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk import/export and re-verification of the bot's data.")
+    parser.add_argument("--db", default="database.db")
+    parser.add_argument("--batch", type=int, default=5000, help="rows per executemany/transaction")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="write a table to CSV")
+    export.add_argument("table", choices=TABLES)
+    export.add_argument("file", help="CSV file, - for stdout")
+
+    load = commands.add_parser("import", help="load a CSV file into a table")
+    load.add_argument("table", choices=TABLES)
+    load.add_argument("file", help="CSV file, - for stdin")
+    load.add_argument("--on-conflict", choices=["skip", "replace"], default="skip", help="keep or overwrite rows whose key already exists")
+
+    check = commands.add_parser("reverify", help="check credited completions against every handle's full submission history")
+    check.add_argument("--since", type=datetime.date.fromisoformat, help="only challenges from this date (YYYY-MM-DD)")
+    check.add_argument("--apply", action="store_true", help="credit solved challenges that were never credited")
+    check.add_argument("--rate", type=float, default=0.5, help="Codeforces requests per second")
+    check.add_argument("--concurrency", type=int, default=4, help="submission histories held in memory at once")
+    check.add_argument("--api", default=CF_API_BASE, help="API base url (e.g. a coordinator's)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
@@ -0,0 +1,147 @@
+# Fake Codeforces API
+# Local aiohttp stand-in for https://codeforces.com/api/ used by the benchmarks.
+# Serves problemset.problems, user.info, user.status and contest.status from recorded payloads
+# (a directory of <method>.json files) or generated ones, with configurable latency,
+# 429 rate and payload size, and counts every call per method.
+
+import asyncio
+import collections
+import json
+import os
+import random
+import time
+
+from aiohttp import web
+
+TAGS = ["implementation", "math", "greedy", "dp", "data structures", "brute force", "constructive algorithms",
+        "graphs", "sortings", "binary search", "dfs and similar", "trees", "strings", "number theory",
+        "combinatorics", "two pointers", "bitmasks", "geometry", "dsu", "shortest paths", "probabilities",
+        "divide and conquer", "hashing", "games", "flows", "interactive", "matrices", "fft"]
+
+class FakeCodeforces:
+    def __init__(self, latency : float = 0.05, error_rate : float = 0.0, problems : int = 10000, submissions : int = 100, fixtures : str | None = None, seed : int = 0):
+        self.latency = latency # Seconds added to every response
+        self.error_rate = error_rate # Fraction of requests answered with a 429
+        self.submission_count = submissions # Submissions per user.status handle
+        self.rng = random.Random(seed)
+
+        self.calls = collections.Counter() # Method to number of calls
+        self.accepted = set() # (contestId, index) every handle has an OK on
+        self.compile_errors = {} # Lowercased handle to (contestId, index) with a fresh COMPILATION_ERROR
+
+        self._fixtures = {}
+        if fixtures is not None:
+            for name in os.listdir(fixtures):
+                if name.endswith(".json"):
+                    with open(os.path.join(fixtures, name), "rb") as f:
+                        self._fixtures[name[:-len(".json")]] = json.load(f)
+
+        if "problemset.problems" in self._fixtures:
+            self.problemset = self._fixtures["problemset.problems"]
+        else:
+            self.problemset = self._generate_problemset(problems)
+        self.problemset_body = json.dumps(self.problemset).encode()
+        self.problems = self.problemset["result"]["problems"]
+
+        self._runner = None
+
+    def _generate_problemset(self, count):
+        problems = []
+        statistics = []
+        for i in range(count):
+            contestId = 2100 - i // 6
+            index = "ABCDEF"[i % 6]
+            problems.append({
+                "contestId": contestId,
+                "index": index,
+                "name": f"Generated Problem {i}",
+                "type": "PROGRAMMING",
+                "points": 500.0 * (i % 6 + 1),
+                "rating": 800 + 100 * self.rng.randrange(28),
+                "tags": self.rng.sample(TAGS, self.rng.randrange(1, 5)),
+            })
+            statistics.append({"contestId": contestId, "index": index, "solvedCount": self.rng.randrange(10, 50000)})
+        return {"status": "OK", "result": {"problems": problems, "problemStatistics": statistics}}
+
+    def _submission(self, sid, handle, problem, verdict, created):
+        return {
+            "id": sid,
+            "contestId": problem["contestId"],
+            "creationTimeSeconds": created,
+            "relativeTimeSeconds": 2147483647,
+            "problem": {"contestId": problem["contestId"], "index": problem["index"], "name": problem.get("name", ""), "rating": problem.get("rating"), "tags": problem.get("tags", [])},
+            "author": {"contestId": problem["contestId"], "members": [{"handle": handle}], "participantType": "PRACTICE"},
+            "programmingLanguage": "C++17 (GCC 7-32)",
+            "verdict": verdict,
+            "testset": "TESTS",
+            "passedTestCount": 10,
+            "timeConsumedMillis": 15,
+            "memoryConsumedBytes": 0,
+        }
+
+    def _user_status(self, handle, start, count):
+        now = int(time.time())
+        subs = []
+        sid = 10 ** 9
+        for contestId, index in sorted(self.accepted):
+            subs.append(self._submission(sid, handle, {"contestId": contestId, "index": index}, "OK", now))
+            sid -= 1
+        if handle.lower() in self.compile_errors:
+            contestId, index = self.compile_errors[handle.lower()]
+            subs.append(self._submission(sid, handle, {"contestId": contestId, "index": index}, "COMPILATION_ERROR", now))
+            sid -= 1
+
+        rng = random.Random(handle)
+        for i in range(self.submission_count):
+            subs.append(self._submission(sid - i, handle, rng.choice(self.problems), rng.choice(["OK", "WRONG_ANSWER", "TIME_LIMIT_EXCEEDED"]), now - 3600 - i * 600))
+        return subs[start - 1:start - 1 + count]
+
+    def _user_info(self, handle):
+        if "user.info" in self._fixtures:
+            profile = dict(self._fixtures["user.info"]["result"][0])
+        else:
+            profile = {"rating": 1500, "maxRating": 1600, "rank": "specialist", "maxRank": "expert", "contribution": 0,
+                       "avatar": "https://userpic.codeforces.org/no-avatar.jpg", "titlePhoto": "https://userpic.codeforces.org/no-title.jpg",
+                       "friendOfCount": 0, "lastOnlineTimeSeconds": int(time.time()), "registrationTimeSeconds": 1500000000}
+        profile["handle"] = handle
+        return profile
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency)
+
+        if self.rng.random() < self.error_rate:
+            return web.json_response({"status": "FAILED", "comment": "Call limit exceeded"}, status=429)
+
+        query = request.query
+        if method == "problemset.problems":
+            return web.Response(body=self.problemset_body, content_type="application/json")
+        elif method == "user.info":
+            handles = query["handles"].split(";")
+            if any(handle.startswith("missing") for handle in handles):
+                return web.json_response({"status": "FAILED", "comment": "handles: User not found"}, status=400)
+            return web.json_response({"status": "OK", "result": [self._user_info(handle) for handle in handles]})
+        elif method == "user.status":
+            start = int(query.get("from", 1))
+            count = int(query.get("count", self.submission_count))
+            return web.json_response({"status": "OK", "result": self._user_status(query["handle"], start, count)})
+        elif method == "contest.status":
+            return web.json_response({"status": "OK", "result": []})
+        return web.json_response({"status": "FAILED", "comment": f"Unknown method {method}"}, status=400)
+
+    # Starts the server, returns the API base url
+    async def start(self, host : str = "127.0.0.1", port : int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/api/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}/api/"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,88 @@
+# Fake Discord objects
+# Just enough of disnake's interaction, user and channel interfaces to call the bot's slash
+# command callbacks and tasks directly, with a configurable delay standing in for Discord's API.
+
+import asyncio
+import time
+
+class FakeUser:
+    def __init__(self, id : int, name : str):
+        self.id = id
+        self.display_name = name
+        self.name = name
+        self.mention = f"<@{id}>"
+
+class FakeGuild:
+    def __init__(self, id : int):
+        self.id = id
+        self.name = f"Guild {id}"
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def defer(self, *args, **kwargs):
+        await asyncio.sleep(self.interaction.latency)
+
+    async def send_message(self, content=None, **kwargs):
+        await asyncio.sleep(self.interaction.latency)
+        self.interaction._record(content, kwargs)
+
+# Stands in for disnake.ApplicationCommandInteraction
+class FakeInteraction:
+    def __init__(self, user : FakeUser, guild_id : int | None = None, channel_id : int | None = None, latency : float = 0.0):
+        self.author = user
+        self.user = user
+        self.guild_id = guild_id
+        self.guild = FakeGuild(guild_id) if guild_id is not None else None
+        self.channel_id = channel_id
+        self.latency = latency # Seconds every Discord call takes
+        self.response = FakeResponse(self)
+
+        self.created = time.perf_counter()
+        self.messages = [] # (perf_counter time, content, embed) of every response and edit
+
+    def _record(self, content, kwargs):
+        self.messages.append((time.perf_counter(), content, kwargs.get("embed")))
+
+    async def edit_original_response(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self._record(content, kwargs)
+
+    # Text of the latest response (content or embed title)
+    def last_text(self) -> str:
+        if not self.messages:
+            return ""
+        _, content, embed = self.messages[-1]
+        return content if content is not None else (embed.title if embed is not None else "")
+
+class FakeChannel:
+    def __init__(self, id : int, latency : float):
+        self.id = id
+        self.latency = latency
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+
+# Stands in for the bot's channel lookups (gateway cache and REST)
+class FakeGateway:
+    def __init__(self, latency : float = 0.0, cached : bool = True):
+        self.latency = latency
+        self.cached = cached # Whether get_channel hits, otherwise every lookup is a fetch
+        self.channels = {}
+        self.fetches = 0
+
+    def _channel(self, id):
+        if id not in self.channels:
+            self.channels[id] = FakeChannel(id, self.latency)
+        return self.channels[id]
+
+    def get_channel(self, id):
+        return self._channel(id) if self.cached else None
+
+    async def fetch_channel(self, id):
+        self.fetches += 1
+        await asyncio.sleep(self.latency)
+        return self._channel(id)
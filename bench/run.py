@@ -0,0 +1,315 @@
+# Offline load test
+# Runs the bot's commands and tasks against the fake Codeforces API and fake Discord objects,
+# on a throwaway copy of the database, and reports latency, API calls and DB time per command.
+#
+# Usage (from the repository root):
+#   python -m bench.run --users 200 --concurrency 50 --latency 0.05 --error-rate 0.02
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from bench.fake_codeforces import FakeCodeforces, TAGS
+from bench.fake_discord import FakeGateway, FakeInteraction, FakeUser
+
+import main
+
+BENCH_USER_ID = 10 ** 15 # Fake Discord user IDs start here
+BENCH_GUILD_ID = 10 ** 16 # Fake guild IDs start here
+
+def percentile(values : list[float], p : float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# Adds up the time spent holding (and waiting for) pooled database connections
+class DatabaseTimer:
+    def __init__(self, db):
+        self.seconds = 0.0
+        self.uses = 0
+
+        read = db.read
+        transaction = db.transaction
+
+        @contextlib.asynccontextmanager
+        async def timed_read():
+            start = time.perf_counter()
+            try:
+                async with read() as conn:
+                    yield conn
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.uses += 1
+
+        @contextlib.asynccontextmanager
+        async def timed_transaction():
+            start = time.perf_counter()
+            try:
+                async with transaction() as conn:
+                    yield conn
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.uses += 1
+
+        db.read = timed_read
+        db.transaction = timed_transaction
+
+class Phase:
+    def __init__(self, name, fake, timer):
+        self.name = name
+        self.fake = fake
+        self.timer = timer
+        self.latencies = []
+        self.failures = 0
+
+    def __enter__(self):
+        self.calls_before = self.fake.calls.copy()
+        self.db_before = self.timer.seconds
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.calls = self.fake.calls - self.calls_before
+        self.db_seconds = self.timer.seconds - self.db_before
+
+    def report(self) -> dict:
+        count = max(1, len(self.latencies))
+        return {
+            "command": self.name,
+            "invocations": len(self.latencies),
+            "failures": self.failures,
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p99_ms": percentile(self.latencies, 99) * 1000,
+            "max_ms": max(self.latencies, default=0) * 1000,
+            "wall_s": self.elapsed,
+            "api_calls": dict(self.calls),
+            "api_calls_per_command": sum(self.calls.values()) / count,
+            "db_ms_per_command": self.db_seconds * 1000 / count,
+        }
+
+async def run_concurrently(count, concurrency, make_call):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await make_call(i)
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+
+def bench_handle(i):
+    return f"bench_user_{i}"
+
+async def seed(args):
+    # Registered users and challenge guilds, written the way the bot would write them
+    async with main.db.transaction() as conn:
+        await conn.executemany("INSERT OR REPLACE INTO user_data(userID, codeforcesHandle, score, lastChallengeDate) VALUES(?, ?, 0, '2000-01-01')",
+                               [(BENCH_USER_ID + i, bench_handle(i)) for i in range(args.users)])
+    for i in range(args.guilds):
+        await main.guilds.set_channel(BENCH_GUILD_ID + i, BENCH_GUILD_ID + i)
+    # The first guilds get their own settings, so they get their own challenge sets
+    for i in range(min(args.configured_guilds, args.guilds)):
+        config = main.DEFAULT_CHALLENGE_CONFIG._replace(ratings=tuple(range(800 + 100 * (i % 5), 2600, 300)), tags=frozenset(TAGS[i % len(TAGS):i % len(TAGS) + 2]))
+        await main.settings.set(BENCH_GUILD_ID + i, config)
+    await main.leaderboard.load()
+
+async def bench_challenge_update(args, fake, timer, gateway):
+    phase = Phase("challenge fan-out", fake, timer)
+    # Every guild due at once, as when catching up after downtime
+    now = time.time()
+    for guild in [main.DEFAULT_SCOPE, *(guild for guild, channel in main.guilds.challenge_channels())]:
+        main.scheduler.schedule(guild, now)
+    with phase:
+        start = time.perf_counter()
+        await main.scheduler.run_due(main.post_challenges)
+        phase.latencies.append(time.perf_counter() - start)
+    sent = sum(channel.sent for channel in gateway.channels.values())
+    phase.failures = len(main.guilds.challenge_channels()) - sent
+    return phase
+
+async def bench_info(args, fake, timer):
+    phase = Phase("info", fake, timer)
+
+    async def call(i):
+        ctx = FakeInteraction(FakeUser(BENCH_USER_ID + i % args.users, bench_handle(i)), BENCH_GUILD_ID, BENCH_GUILD_ID, args.discord_latency)
+        start = time.perf_counter()
+        await main.on_slash_command(ctx)
+        await main.info.callback(ctx)
+        phase.latencies.append(time.perf_counter() - start)
+        if "Error" in (ctx.messages[-1][2].description if ctx.messages and ctx.messages[-1][2] else ""):
+            phase.failures += 1
+
+    with phase:
+        await run_concurrently(args.users, args.concurrency, call)
+    return phase
+
+async def bench_complete_challenge(args, fake, timer):
+    phase = Phase("complete_challenge", fake, timer)
+    challenge_date = main.scheduler.current_date(BENCH_GUILD_ID)
+    challenge_set = await main.db_get_challenge_set(challenge_date, main.settings.scope(BENCH_GUILD_ID))
+    fake.accepted = {(problem.contestId, problem.index) for problem in challenge_set.values()}
+    rating = min(challenge_set)
+
+    async def call(i):
+        ctx = FakeInteraction(FakeUser(BENCH_USER_ID + i, bench_handle(i)), BENCH_GUILD_ID, BENCH_GUILD_ID, args.discord_latency)
+        start = time.perf_counter()
+        await main.on_slash_command(ctx)
+        await main.complete_challenge.callback(ctx, rating)
+        phase.latencies.append(time.perf_counter() - start)
+        if "successfully" not in ctx.last_text():
+            phase.failures += 1
+
+    with phase:
+        await run_concurrently(args.users, args.concurrency, call)
+    return phase
+
+async def bench_register(args, fake, timer):
+    phase = Phase("register (until verified)", fake, timer)
+    contexts = []
+    stop = asyncio.Event()
+
+    async def checker():
+        while not stop.is_set():
+            await main.registration_check.coro()
+            await asyncio.sleep(args.poll_interval)
+
+    async def call(i):
+        handle = f"bench_new_{i}"
+        ctx = FakeInteraction(FakeUser(BENCH_USER_ID + args.users + i, handle), BENCH_GUILD_ID, BENCH_GUILD_ID, args.discord_latency)
+        contexts.append(ctx)
+        await main.on_slash_command(ctx)
+        await main.register.callback(ctx, handle)
+
+        # The "user" submits their Compile Error right away
+        pending = main.registrations.pending.get(ctx.author.id)
+        if pending is not None:
+            fake.compile_errors[handle.lower()] = (pending.contestId, pending.index)
+
+    with phase:
+        check_task = asyncio.create_task(checker())
+        await run_concurrently(args.registrations, args.concurrency, call)
+        deadline = time.perf_counter() + main.REGISTER_TIMEOUT + 5
+        while len(main.registrations) > 0 and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        stop.set()
+        await check_task
+
+    for ctx in contexts:
+        finished = ctx.last_text().endswith("verified!")
+        if finished:
+            phase.latencies.append(ctx.messages[-1][0] - ctx.created)
+        else:
+            phase.failures += 1
+    return phase
+
+async def bench_leaderboard(args, fake, timer):
+    phase = Phase("leaderboard", fake, timer)
+
+    async def call(i):
+        ctx = FakeInteraction(FakeUser(BENCH_USER_ID + i % args.users, bench_handle(i)), BENCH_GUILD_ID, BENCH_GUILD_ID, args.discord_latency)
+        start = time.perf_counter()
+        await main.leaderboard_command.callback(ctx, page=1 + i % 5, scope="server" if i % 2 else "global")
+        phase.latencies.append(time.perf_counter() - start)
+
+    with phase:
+        await run_concurrently(args.users, args.concurrency, call)
+    return phase
+
+async def bench_recommend(args, fake, timer):
+    phase = Phase("recommend", fake, timer)
+
+    async def call(i):
+        ctx = FakeInteraction(FakeUser(BENCH_USER_ID + i % args.users, bench_handle(i)), BENCH_GUILD_ID, BENCH_GUILD_ID, args.discord_latency)
+        start = time.perf_counter()
+        await main.on_slash_command(ctx)
+        await main.recommend.callback(ctx, count=5, tag=None)
+        phase.latencies.append(time.perf_counter() - start)
+        embed = ctx.messages[-1][2] if ctx.messages else None
+        if embed is None or not embed.title.startswith("Recommended"):
+            phase.failures += 1
+
+    with phase:
+        await run_concurrently(args.users, args.concurrency, call)
+    return phase
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="shors-bench-")
+    db_path = os.path.join(workdir, "database.db")
+    shutil.copyfile(args.database, db_path)
+
+    fake = FakeCodeforces(args.latency, args.error_rate, args.problems, args.submissions, args.fixtures, args.seed)
+    base_url = await fake.start()
+
+    # Point the bot's shared objects at the fakes
+    main.db.path = db_path
+    main.cf_client.base_url = base_url
+    main.cf_client.set_rate(args.rate, args.burst)
+    main.cf_client.backoff = 0.1
+    gateway = FakeGateway(args.discord_latency, cached=not args.uncached_channels)
+    main.broadcaster.bot = gateway
+    main.registrations.poll_interval = args.poll_interval
+    main.SNAPSHOT_DIR = os.path.join(workdir, "snapshots")
+
+    phases = []
+    try:
+        start = time.perf_counter()
+        await main.lifecycle.start()
+        print(f"Startup took {(time.perf_counter() - start) * 1000:.1f} ms")
+        await seed(args)
+
+        timer = DatabaseTimer(main.db)
+        phases.append(await bench_challenge_update(args, fake, timer, gateway))
+        phases.append(await bench_info(args, fake, timer))
+        phases.append(await bench_complete_challenge(args, fake, timer))
+        phases.append(await bench_register(args, fake, timer))
+        phases.append(await bench_leaderboard(args, fake, timer))
+        phases.append(await bench_recommend(args, fake, timer))
+    finally:
+        start = time.perf_counter()
+        await main.lifecycle.stop()
+        print(f"Shutdown took {(time.perf_counter() - start) * 1000:.1f} ms")
+        await fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    reports = [phase.report() for phase in phases]
+    print(f"{'command':<28}{'n':>6}{'fail':>6}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'wall s':>9}{'api/cmd':>9}{'db ms/cmd':>11}")
+    for r in reports:
+        print(f"{r['command']:<28}{r['invocations']:>6}{r['failures']:>6}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}{r['wall_s']:>9.2f}{r['api_calls_per_command']:>9.2f}{r['db_ms_per_command']:>11.2f}")
+    for r in reports:
+        print(f"{r['command']}: {r['api_calls']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load test of the bot against a fake Codeforces API and fake Discord.")
+    parser.add_argument("--users", type=int, default=100, help="registered users, and invocations of /info, /complete_challenge, /leaderboard and /recommend")
+    parser.add_argument("--registrations", type=int, default=20, help="invocations of /register")
+    parser.add_argument("--guilds", type=int, default=50, help="guilds the challenge is broadcast to")
+    parser.add_argument("--concurrency", type=int, default=25, help="commands in flight at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Codeforces latency (s)")
+    parser.add_argument("--discord-latency", type=float, default=0.02, help="fake Discord latency (s)")
+    parser.add_argument("--configured-guilds", type=int, default=10, help="guilds with their own challenge settings (and challenge set)")
+    parser.add_argument("--uncached-channels", action="store_true", help="make every channel lookup a REST fetch")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of Codeforces requests answered with 429")
+    parser.add_argument("--problems", type=int, default=10000, help="problems in the generated problemset")
+    parser.add_argument("--submissions", type=int, default=100, help="submissions per handle in user.status")
+    parser.add_argument("--fixtures", help="directory of recorded <method>.json payloads to serve instead of generated ones")
+    parser.add_argument("--rate", type=float, default=20, help="Codeforces requests per second allowed by the client")
+    parser.add_argument("--burst", type=float, default=1, help="Codeforces request burst allowed by the client")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="seconds between registration checks")
+    parser.add_argument("--database", default=main.DB, help="database to copy for the run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    main.bot.loop.run_until_complete(run(args))
@@ -0,0 +1,115 @@
+# Challenge broadcast
+# Sends the daily challenge to every guild at once (bounded by a semaphore) instead of one by one.
+# Each guild's delivery is a row in challenge_broadcast, written before anything is sent,
+# so one broken channel can't stop the others and a crash mid-broadcast can be resumed.
+# Deliveries that failed for another reason stay pending and are retried (up to max_attempts),
+# until a newer challenge replaces theirs.
+
+import asyncio
+import datetime
+import logging
+import time
+import typing
+
+import disnake
+
+from database import Database
+from metrics import BROADCAST_DELIVERIES, BROADCAST_SECONDS
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS `challenge_broadcast` (
+    `date` TEXT,
+    `guild` TEXT,
+    `channel` TEXT,
+    `status` TEXT DEFAULT 'pending',
+    `attempts` INTEGER DEFAULT 0,
+    `error` TEXT,
+    PRIMARY KEY(`date`, `guild`)
+)
+"""
+
+# Delivery statuses
+PENDING = "pending" # Not sent yet (or failed and will be retried)
+SENT = "sent"
+GONE = "gone" # Channel deleted or no permission, retrying won't help
+EXPIRED = "expired" # Still pending when its challenge was no longer current, never sent
+
+class ChallengeBroadcaster:
+    # disnake already waits on Discord's per-route rate limit buckets (message sends are
+    # bucketed per channel) and on the global limit, the semaphore only caps how many
+    # sends are in flight at once.
+    def __init__(self, bot : disnake.Client, db : Database, concurrency : int = 10, max_attempts : int = 3):
+        self.bot = bot
+        self.db = db
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self._running = asyncio.Lock() # One run at a time, so a retry never resends what a running broadcast is sending
+
+    # Records one pending delivery per (guild, channel), inside the caller's transaction
+    async def queue(self, conn, date : datetime.date, channels : list[tuple[int, int]]):
+        await conn.executemany("INSERT OR IGNORE INTO challenge_broadcast(date, guild, channel, status) VALUES(?, ?, ?, ?)",
+                               [(date.isoformat(), guild, channel, PENDING) for guild, channel in channels])
+
+    # Whether some deliveries of this date still need sending
+    async def has_pending(self, date : datetime.date) -> bool:
+        row = await self.db.fetchone("SELECT 1 FROM challenge_broadcast WHERE date = ? AND status = ? AND attempts < ? LIMIT 1", (date.isoformat(), PENDING, self.max_attempts))
+        return row is not None
+
+    # Gives up on the pending deliveries of dates before this one, an old challenge is no use to post.
+    # Returns the number of deliveries expired.
+    async def expire_before(self, date : datetime.date) -> int:
+        expired = await self.db.execute("UPDATE challenge_broadcast SET status = ? WHERE date < ? AND status = ?", (EXPIRED, date.isoformat(), PENDING))
+        if expired:
+            log.warning(f"Warning (BROADCAST): {expired} deliveries of challenges before {date.isoformat()} were never sent, expired them")
+        return expired
+
+    # Sends every pending guild of this date (only the given ones, if any) its embed (embed_for(guild)).
+    # Returns (sent, failed) counts.
+    async def run(self, date : datetime.date, embed_for : typing.Callable[[int], disnake.Embed], guilds : typing.Iterable[int] | None = None) -> tuple[int, int]:
+        async with self._running:
+            rows = await self.db.fetchall("SELECT guild, channel FROM challenge_broadcast WHERE date = ? AND status = ? AND attempts < ?", (date.isoformat(), PENDING, self.max_attempts))
+            if guilds is not None:
+                guilds = set(guilds)
+                rows = [row for row in rows if int(row[0]) in guilds]
+            if not rows:
+                return (0, 0)
+
+            start = time.perf_counter()
+            semaphore = asyncio.Semaphore(self.concurrency)
+            results = await asyncio.gather(*(self._deliver(semaphore, date, int(guild), int(channel), embed_for(int(guild))) for guild, channel in rows))
+
+        duration = time.perf_counter() - start
+        BROADCAST_SECONDS.observe(duration)
+        sent = sum(results)
+        failed = len(results) - sent
+        log.info(f"Challenge broadcast for {date.isoformat()}: {sent} sent, {failed} failed, took {duration:.2f}s")
+        return (sent, failed)
+
+    async def _resolve_channel(self, channel_id : int):
+        # Gateway cache first, a REST round trip only if the channel isn't cached
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            channel = await self.bot.fetch_channel(channel_id)
+        return channel
+
+    async def _deliver(self, semaphore, date, guild, channel_id, embed) -> bool:
+        async with semaphore:
+            try:
+                channel = await self._resolve_channel(channel_id)
+                await channel.send(embed=embed)
+            except (disnake.NotFound, disnake.Forbidden) as e:
+                await self._record(date, guild, GONE, repr(e))
+                return False
+            except Exception as e: # Anything else stays pending and is retried later
+                log.error(f"Error (BROADCAST): guild {guild} channel {channel_id}: {e!r}")
+                await self._record(date, guild, PENDING, repr(e))
+                return False
+
+        await self._record(date, guild, SENT, None)
+        return True
+
+    async def _record(self, date, guild, status, error):
+        BROADCAST_DELIVERIES.inc(status)
+        await self.db.execute("UPDATE challenge_broadcast SET status = ?, attempts = attempts + 1, error = ? WHERE date = ? AND guild = ?", (status, error, date.isoformat(), guild))
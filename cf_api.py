@@ -0,0 +1,210 @@
+# Codeforces API client
+# One long-lived aiohttp session is shared by the whole bot. Every request goes through a
+# priority queue and a global token bucket, so the combined request rate of all commands and
+# tasks stays inside Codeforces' limit and each caller only waits for its own response.
+
+import asyncio
+import itertools
+import random
+import time
+import typing
+
+import aiohttp
+
+from metrics import CF_REQUESTS, CF_REQUEST_SECONDS, CF_WAIT_SECONDS, tracer
+
+CF_API_BASE = "https://codeforces.com/api/"
+
+# Request priorities (lower is served first)
+PRIORITY_INTERACTIVE = 0 # Slash commands, somebody is waiting on these
+PRIORITY_BACKGROUND = 1 # Tasks, nobody is waiting on these
+
+RETRY_STATUSES = (429, 503) # Rate limited / "Call limit exceeded"
+
+PRIORITY_HEADER = "X-Request-Priority" # Sent to a coordinator (cf_coordinator.py), which queues by it
+
+# Token bucket: refills `rate` tokens per second, holds at most `capacity` tokens.
+# Only the dispatcher takes tokens, so no lock is needed.
+class TokenBucket:
+    def __init__(self, rate : float, capacity : float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    # Empties the bucket, used when Codeforces tells us to slow down
+    def drain(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+
+class CodeforcesClient:
+    def __init__(self, base_url : str = CF_API_BASE, rate : float = 0.5, burst : float = 1, max_retries : int = 4, backoff : float = 2, timeout : float = 30, forward_priority : bool = False):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff = backoff # Seconds before the first retry, doubled every attempt
+        self.timeout = timeout
+        self.forward_priority = forward_priority # Send the priority along, when base_url is a coordinator
+
+        self._bucket = TokenBucket(rate, burst)
+        self._seq = itertools.count() # Keeps requests of the same priority in FIFO order
+        self._queue = None
+        self._session = None
+        self._dispatcher = None
+        self._in_flight = set()
+
+    # The session and queue have to be created inside the running event loop,
+    # so they are made on first use instead of in __init__.
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(self.base_url, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def set_rate(self, rate : float, burst : float = 1):
+        self._bucket = TokenBucket(rate, burst)
+
+    def queue_depth(self) -> int:
+        return 0 if self._queue is None else self._queue.qsize()
+
+    # Makes one request to the API.
+    # If successful, a dict (parsed json) will be returned
+    # Otherwise, the status code is returned
+    async def request(self, method : str, params : dict | None = None, priority : int = PRIORITY_INTERACTIVE) -> dict | int:
+        return await self._enqueue(method, params, priority, None, None)
+
+    # Same as request(), but sends extra headers (e.g. If-None-Match) and also returns the response headers.
+    # A 304 Not Modified is returned as the status code, like any other non-2XX response.
+    # If a parser is given, a 2XX response is handed to `await parser(resp)` instead of being read
+    # whole with resp.json(), so large payloads can be streamed.
+    async def request_conditional(self, method : str, params : dict | None = None, headers : dict | None = None, priority : int = PRIORITY_BACKGROUND, parser = None) -> tuple[typing.Any, dict]:
+        return await self._enqueue(method, params, priority, headers or {}, parser)
+
+    async def _enqueue(self, method, params, priority, headers, parser):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await self._queue.put((priority, next(self._seq), 0, method, params or {}, headers, parser, future))
+        try:
+            return await future
+        finally:
+            waited = time.perf_counter() - start
+            CF_WAIT_SECONDS.observe(waited, method, priority)
+            tracer.span(f"cf {method}", waited)
+
+    async def _dispatch(self):
+        while True:
+            item = await self._queue.get()
+            future = item[-1]
+            if future.done():
+                continue # Caller gave up (cancelled), don't spend a token on it
+
+            await self._bucket.acquire()
+
+            # The request itself runs in its own task, so a slow response
+            # never holds up the requests queued behind it.
+            self._track(asyncio.create_task(self._perform(item)))
+
+    def _track(self, task):
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _perform(self, item):
+        priority, seq, attempt, method, params, headers, parser, future = item
+
+        retry_after = None
+        send_headers = headers
+        if self.forward_priority:
+            send_headers = {**(headers or {}), PRIORITY_HEADER: str(priority)}
+        start = time.perf_counter()
+        try:
+            async with self._session.get(method, params=params, headers=send_headers) as resp:
+                status = resp.status
+                resp_headers = dict(resp.headers)
+
+                if 200 <= status and status <= 299: # 2XX successful
+                    result = await (parser(resp) if parser is not None else resp.json())
+                else:
+                    result = status
+                    if "Retry-After" in resp.headers:
+                        try:
+                            retry_after = float(resp.headers["Retry-After"])
+                        except ValueError:
+                            pass
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = None
+            result = e
+        except asyncio.CancelledError:
+            future.cancel() # Client is closing, don't leave the caller hanging
+            raise
+        except Exception as e: # Malformed payload (parser or json error), retrying won't fix it
+            CF_REQUESTS.inc(method, "invalid")
+            if not future.done():
+                future.set_exception(e)
+            return
+        finally:
+            CF_REQUEST_SECONDS.observe(time.perf_counter() - start, method)
+        CF_REQUESTS.inc(method, status if status is not None else type(result).__name__)
+
+        retryable = status is None or status in RETRY_STATUSES
+        if retryable and attempt < self.max_retries:
+            self._bucket.drain()
+            delay = retry_after if retry_after is not None else self.backoff * (2 ** attempt) * (1 + random.random() / 4)
+            self._track(asyncio.create_task(self._requeue((priority, seq, attempt + 1, method, params, headers, parser, future), delay)))
+            return
+
+        if future.done():
+            return
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        elif headers is not None:
+            future.set_result((result, resp_headers))
+        else:
+            future.set_result(result)
+
+    async def _requeue(self, item, delay):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            item[-1].cancel()
+            raise
+        await self._queue.put(item)
+
+    # Waits until every queued request was answered (retries included), e.g. before closing.
+    # Returns False if some were still pending after `timeout` seconds.
+    async def drain(self, timeout : float) -> bool:
+        deadline = time.monotonic() + timeout
+        while self.queue_depth() or self._in_flight:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for task in list(self._in_flight):
+            task.cancel()
+        if self._queue is not None:
+            while not self._queue.empty():
+                future = self._queue.get_nowait()[-1]
+                if not future.done():
+                    future.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
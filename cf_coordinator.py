@@ -0,0 +1,100 @@
+# Codeforces coordinator
+# When the bot runs as several shard processes, each one would otherwise have its own token bucket
+# and together they'd go over Codeforces' limit. This small local proxy owns the only CodeforcesClient:
+# shard processes point their client at it (CF_COORDINATOR_URL) and it serves the same /api/{method}
+# URLs, queueing every request by the priority the shard sent, retrying 429s itself and streaming
+# responses back as they arrive.
+#
+# Usage:
+#   python cf_coordinator.py --port 8787 --rate 0.5
+
+import argparse
+import asyncio
+
+from aiohttp import web
+
+from cf_api import CodeforcesClient, CF_API_BASE, PRIORITY_BACKGROUND, PRIORITY_HEADER
+
+CHUNK_SIZE = 64 * 1024
+FORWARDED_REQUEST_HEADERS = ("If-None-Match", "If-Modified-Since")
+FORWARDED_RESPONSE_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+class CodeforcesCoordinator:
+    def __init__(self, client : CodeforcesClient):
+        self.client = client
+        self._runner = None
+
+    async def _handle(self, request : web.Request) -> web.StreamResponse:
+        method = request.match_info["method"]
+        try:
+            priority = int(request.headers.get(PRIORITY_HEADER, PRIORITY_BACKGROUND))
+        except ValueError:
+            priority = PRIORITY_BACKGROUND
+        headers = {name: request.headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+
+        out = web.StreamResponse()
+
+        # Runs inside the client once Codeforces answers with a 2XX, copies the body through chunk by chunk
+        async def relay(resp):
+            if out.prepared:
+                raise RuntimeError(f"{method} failed midway through the response") # Can't retry, part of it was sent
+            for name in FORWARDED_RESPONSE_HEADERS:
+                if name in resp.headers:
+                    out.headers[name] = resp.headers[name]
+            await out.prepare(request)
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                await out.write(chunk)
+            return out
+
+        result, resp_headers = await self.client.request_conditional(method, dict(request.query), headers, priority, relay)
+        if isinstance(result, int):
+            # Non-2XX (including 304), passed on as is. The shard's client treats it like Codeforces' own.
+            return web.Response(status=result, headers={name: resp_headers[name] for name in FORWARDED_RESPONSE_HEADERS[1:] if name in resp_headers})
+
+        await out.write_eof()
+        return out
+
+    async def _health(self, request : web.Request) -> web.Response:
+        return web.json_response({"status": "OK", "queue_depth": self.client.queue_depth()})
+
+    # Starts serving, returns the API base url for the shards' clients
+    async def start(self, host : str = "127.0.0.1", port : int = 8787) -> str:
+        app = web.Application()
+        app.router.add_get("/api/{method}", self._handle)
+        app.router.add_get("/health", self._health)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}/api/"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.client.close()
+
+async def serve(args):
+    coordinator = CodeforcesCoordinator(CodeforcesClient(args.upstream, rate=args.rate, burst=args.burst))
+    url = await coordinator.start(args.host, args.port)
+    print(f"Codeforces coordinator listening on {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await coordinator.stop()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shares one Codeforces rate limit between bot processes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--rate", type=float, default=0.5, help="Codeforces requests per second, for all processes together")
+    parser.add_argument("--burst", type=float, default=1, help="requests that may be sent back to back after an idle period")
+    parser.add_argument("--upstream", default=CF_API_BASE, help="API base url requests are sent to")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+# Challenge selection
+# Draws the daily challenge sets. Every problem a scope (a guild with its own settings, or the
+# shared DEFAULT_SCOPE) was ever given is remembered, and for each (scope, rating) a pool of the
+# matching problems it hasn't had yet is built once from the catalog's rating/tag index. Each draw
+# then swaps a random pool entry to the end and pops it, so no problem repeats and a draw is O(1)
+# however many guilds are configured.
+
+import logging
+import random
+
+from database import Database
+from guild_settings import ChallengeConfig, DEFAULT_SCOPE
+from problemset import Problem, ProblemCatalog
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS `challenge_data` (
+    `date` TEXT,
+    `guild` INTEGER DEFAULT 0,
+    `rating` INTEGER,
+    `problemIndex` TEXT,
+    `problemContestID` INTEGER,
+    PRIMARY KEY(`date`, `guild`, `rating`)
+)
+"""
+
+# challenge_data used to hold one set per date, keyed by (date, rating).
+# SQLite can't change a primary key in place, so the old table is rebuilt once, its sets becoming DEFAULT_SCOPE's.
+async def migrate(conn):
+    async with conn.execute("PRAGMA table_info(challenge_data)") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    if "guild" in columns:
+        return
+
+    await conn.execute("ALTER TABLE challenge_data RENAME TO challenge_data_old")
+    await conn.execute(SCHEMA)
+    await conn.execute("INSERT INTO challenge_data(date, guild, rating, problemIndex, problemContestID) SELECT date, ?, rating, problemIndex, problemContestID FROM challenge_data_old", (DEFAULT_SCOPE,))
+    await conn.execute("DROP TABLE challenge_data_old")
+    log.info("Migrated challenge_data to per-guild challenge sets")
+
+# Who may be credited for a scope's set: the shared set is everyone's, a guild's own set only its members'
+# (guild_members, see leaderboard.py), like /complete_challenge, which takes the set of the guild it's used in.
+# Returns the (scope, userID) pairs of the members of the given scopes.
+async def scope_members(db : Database, scopes) -> set[tuple[int, int]]:
+    guilds = [scope for scope in scopes if scope != DEFAULT_SCOPE]
+    if not guilds:
+        return set()
+    rows = await db.fetchall(f"SELECT guild, userID FROM guild_members WHERE guild IN ({', '.join('?' * len(guilds))})", guilds)
+    return {(int(guild), userID) for guild, userID in rows}
+
+def may_complete(scope : int, userID : int, members : set[tuple[int, int]]) -> bool:
+    return scope == DEFAULT_SCOPE or (scope, userID) in members
+
+class ChallengeSelector:
+    def __init__(self, catalog : ProblemCatalog, rng : random.Random | None = None):
+        self.catalog = catalog
+        self.rng = rng or random.Random()
+
+        self.issued = {} # Scope to set of (contestId, index) it was given
+        self._pools = {} # (scope, rating) to (pool key, list of Problems not issued yet)
+
+    # Loads every problem ever issued
+    async def load(self, db : Database):
+        rows = await db.fetchall("SELECT guild, problemContestID, problemIndex FROM challenge_data")
+        self.issued = {}
+        self._pools = {}
+        for guild, contestId, index in rows:
+            self.issued.setdefault(int(guild), set()).add((contestId, index))
+
+    def _pool(self, scope : int, rating : int, config : ChallengeConfig) -> list[Problem]:
+        # Rebuilt when the catalog or the filters change, otherwise kept between days
+        key = (self.catalog.version, config.minContestId, config.tags)
+        cached = self._pools.get((scope, rating))
+        if cached is not None and cached[0] == key and cached[1]:
+            return cached[1]
+
+        candidates = self.catalog.tagged_candidates(rating, config.tags, config.minContestId)
+        issued = self.issued.setdefault(scope, set())
+        pool = [p for p in candidates if (p.contestId, p.index) not in issued]
+        if not pool and candidates:
+            # Every matching problem was used already, start over rather than post nothing
+            log.warning(f"Warning (CHALLENGE): scope {scope} ran out of unused {rating}-rated problems, repeats are allowed again")
+            issued.difference_update((p.contestId, p.index) for p in candidates)
+            pool = list(candidates)
+
+        self._pools[(scope, rating)] = (key, pool)
+        return pool
+
+    # Records a set drawn elsewhere (e.g. by another bot process), so it isn't drawn again here
+    def mark_issued(self, scope : int, challenge_set : dict[int, Problem]):
+        self.issued.setdefault(scope, set()).update((problem.contestId, problem.index) for problem in challenge_set.values())
+
+    # Draws a challenge set ({rating: Problem}) for a scope, never repeating one of its earlier problems.
+    # Ratings without any matching problem are left out.
+    def draw(self, scope : int, config : ChallengeConfig) -> dict[int, Problem]:
+        challenge_set = {}
+        for rating in config.ratings:
+            issued = self.issued.setdefault(scope, set())
+            problem = None
+            while problem is None:
+                pool = self._pool(scope, rating, config)
+                if not pool:
+                    break
+
+                i = self.rng.randrange(len(pool))
+                pool[i], pool[-1] = pool[-1], pool[i]
+                problem = pool.pop()
+                if (problem.contestId, problem.index) in issued:
+                    problem = None # Marked issued after the pool was built
+
+            if problem is None:
+                log.warning(f"Warning (CHALLENGE): no {rating}-rated problems match the settings of scope {scope}, skipping")
+                continue
+
+            self.issued[scope].add((problem.contestId, problem.index))
+            challenge_set[rating] = problem
+        return challenge_set
@@ -0,0 +1,179 @@
+# Contest poller
+# Credits challenge solves automatically. Instead of one user.status request per user, every
+# challenge problem's contest is polled with contest.status, only reading submissions newer
+# than the stored cursor, and accepted submissions are matched against every registered handle.
+# A poll reads at most max_pages pages. If more arrived since the last one, the unread gap below is
+# remembered, and the next polls continue it from where they stopped after reading the newest.
+
+import datetime
+import logging
+import typing
+
+from cf_api import CodeforcesClient, PRIORITY_BACKGROUND
+from challenges import may_complete, scope_members
+from database import Database
+from ledger import Completion
+from scoring import credit_challenges
+
+log = logging.getLogger(__name__)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS `contest_poll_cursor` (
+        `date` TEXT,
+        `contestId` INTEGER,
+        `lastSubmissionId` INTEGER,
+        PRIMARY KEY(`date`, `contestId`)
+    )
+    """,
+    # Contests whose last poll ran out of pages, submissions between lastSubmissionId and gapTop are unread
+    """
+    CREATE TABLE IF NOT EXISTS `contest_poll_gap` (
+        `date` TEXT,
+        `contestId` INTEGER,
+        `head` INTEGER,
+        `gapTop` INTEGER,
+        `gapOffset` INTEGER,
+        PRIMARY KEY(`date`, `contestId`)
+    )
+    """,
+]
+
+class PollState(typing.NamedTuple):
+    cursor : int # Every submission up to this id was read
+    head : int # Newest submission read
+    gapTop : int | None = None # Lowest submission read above the unread ones (after cursor), None if there are none
+    gapOffset : int = 0 # Position of gapTop in contest.status at the last poll
+
+class ContestPoller:
+    def __init__(self, db : Database, client : CodeforcesClient, page_size : int = 1000, max_pages : int = 10):
+        self.db = db
+        self.client = client
+        self.page_size = page_size # Submissions per contest.status request
+        self.max_pages = max_pages # Pages read per contest per poll
+
+    # Lowercased handle to userID, for every registered user
+    async def _handle_index(self) -> dict[str, int]:
+        rows = await self.db.fetchall("SELECT userID, codeforcesHandle FROM user_data WHERE codeforcesHandle IS NOT NULL")
+        return {handle.lower(): userID for userID, handle in rows}
+
+    async def _page(self, contestId : int, position : int) -> list[dict] | None:
+        result = await self.client.request("contest.status", {"contestId": contestId, "from": position, "count": self.page_size}, PRIORITY_BACKGROUND)
+        if isinstance(result, int):
+            log.error(f"Error (POLLER): Codeforces responded with a status code of {result} for contest {contestId}!")
+            return None
+        elif result["status"] != "OK":
+            log.error(f"Error (POLLER): Codeforces responded with a status string of {result['status']} for contest {contestId}!")
+            return None
+        return result["result"]
+
+    # Reads at most `pages` pages from position (1 is the newest submission) down to the first submission
+    # with an id <= stop (or older than since), appending those with an id below skip_from to out.
+    # Returns (reached stop, pages read, next position, id of the first submission read), or None if a request failed.
+    async def _read(self, contestId, position, stop, since, skip_from, pages, out):
+        first = None
+        for page in range(pages):
+            page_subs = await self._page(contestId, position)
+            if page_subs is None:
+                return None
+            for sub in page_subs: # Newest first
+                if first is None:
+                    first = sub["id"]
+                if sub["id"] <= stop or sub["creationTimeSeconds"] < since:
+                    return (True, page + 1, position, first)
+                position += 1
+                if skip_from is None or sub["id"] < skip_from:
+                    out.append(sub)
+            if len(page_subs) < self.page_size:
+                return (True, page + 1, position, first)
+        return (False, pages, position, first)
+
+    # Reads the submissions of a contest not read yet (and not older than since), at most max_pages pages.
+    # The newest ones are read first, then the gap a previous poll left, from where it stopped.
+    # Returns (submissions, new PollState), or None if a request failed.
+    async def _new_submissions(self, contestId : int, state : PollState, since : float):
+        submissions = []
+        read = await self._read(contestId, 1, state.head, since, None, self.max_pages, submissions)
+        if read is None:
+            return None
+        reached, pages, position, first = read
+        arrived = len(submissions) # Submissions since the last poll, older ones moved down by as many positions
+        head = submissions[0]["id"] if submissions else state.head
+
+        if not reached:
+            # Ran out of pages before reaching what was read: everything below is a gap (covering any older one)
+            log.warning(f"Warning (POLLER): more than {self.max_pages * self.page_size} new submissions in contest {contestId}, the rest is read on the next polls")
+            return (submissions, PollState(state.cursor, head, submissions[-1]["id"], position - 1))
+        if state.gapTop is None:
+            return (submissions, PollState(head, head))
+
+        # Continue the gap where the last poll stopped (a little before, in case submissions were removed)
+        start = max(1, state.gapOffset + arrived + 1 - max(1, self.page_size // 20))
+        if pages == self.max_pages:
+            return (submissions, state._replace(head=head, gapOffset=state.gapOffset + arrived))
+        gap = []
+        read = await self._read(contestId, start, state.cursor, since, state.gapTop, self.max_pages - pages, gap)
+        if read is None:
+            return None
+        reached, pages, position, first = read
+        submissions += gap
+        if reached:
+            log.info(f"Contest poller caught up with contest {contestId}")
+            return (submissions, PollState(head, head))
+        if start > 1 and first is not None and first < state.gapTop:
+            return (submissions, state._replace(head=head, gapOffset=0)) # Started past the gap's top, read it again from the newest
+        return (submissions, PollState(state.cursor, head, gap[-1]["id"] if gap else state.gapTop, position - 1))
+
+    # Polls every contest of the date's challenge sets ({scope: {rating: Problem}}) and credits accepted
+    # solves submitted after `since` (unix time). Returns a dict of {userID: points} credited.
+    async def poll(self, date : datetime.date, challenge_sets : dict[int, dict], since : float) -> dict[int, int]:
+        # (contestId, index) to [(rating, scope)], a problem can be in several scopes' sets
+        ratings = {}
+        for scope, challenge_set in challenge_sets.items():
+            for rating, problem in challenge_set.items():
+                ratings.setdefault((problem.contestId, problem.index), []).append((rating, scope))
+        if not ratings:
+            return {}
+        contests = {contestId for contestId, index in ratings}
+        members = await scope_members(self.db, challenge_sets)
+
+        states = {contestId: PollState(cursor, cursor) for contestId, cursor in await self.db.fetchall("SELECT contestId, lastSubmissionId FROM contest_poll_cursor WHERE date = ?", (date.isoformat(),))}
+        for contestId, head, gapTop, gapOffset in await self.db.fetchall("SELECT contestId, head, gapTop, gapOffset FROM contest_poll_gap WHERE date = ?", (date.isoformat(),)):
+            states[contestId] = states.get(contestId, PollState(0, 0))._replace(head=head, gapTop=gapTop, gapOffset=gapOffset)
+        handles = await self._handle_index()
+
+        completions = {} # userID to the Completion of the highest rating solved
+        new_states = {}
+        for contestId in contests:
+            polled = await self._new_submissions(contestId, states.get(contestId, PollState(0, 0)), since)
+            if polled is None:
+                continue
+            submissions, new_states[contestId] = polled
+
+            for sub in submissions:
+                if sub.get("verdict") != "OK":
+                    continue
+                matches = ratings.get((sub["problem"].get("contestId"), sub["problem"]["index"]))
+                if matches is None:
+                    continue
+                for member in sub["author"]["members"]:
+                    userID = handles.get(member["handle"].lower())
+                    if userID is None:
+                        continue
+                    for rating, scope in matches:
+                        if may_complete(scope, userID, members) and (userID not in completions or rating > completions[userID].rating):
+                            completions[userID] = Completion(rating, scope, sub["id"])
+
+        # Scores and cursors move together, so a crash never credits a submission twice or skips one
+        async with self.db.transaction() as conn:
+            credited = await credit_challenges(conn, date, completions)
+            await conn.executemany("INSERT OR REPLACE INTO contest_poll_cursor(date, contestId, lastSubmissionId) VALUES(?, ?, ?)",
+                                   [(date.isoformat(), contestId, state.cursor) for contestId, state in new_states.items()])
+            await conn.executemany("DELETE FROM contest_poll_gap WHERE date = ? AND contestId = ?",
+                                   [(date.isoformat(), contestId) for contestId, state in new_states.items() if state.gapTop is None])
+            await conn.executemany("INSERT OR REPLACE INTO contest_poll_gap(date, contestId, head, gapTop, gapOffset) VALUES(?, ?, ?, ?, ?)",
+                                   [(date.isoformat(), contestId, state.head, state.gapTop, state.gapOffset) for contestId, state in new_states.items() if state.gapTop is not None])
+
+        if credited:
+            log.info(f"Contest poller credited {len(credited)} users for {date.isoformat()}")
+        return credited
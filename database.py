@@ -0,0 +1,176 @@
+# Database layer
+# A small pool of persistent aiosqlite connections shared by every command and task.
+# Connections stay open (so sqlite's statement cache keeps prepared statements around),
+# the file is in WAL mode so reads never wait on the writer, and all writes of one command
+# go through a single transaction on the writer connection.
+# Connections are handed out wrapped in TimedConnection, which records how long each statement takes.
+
+import asyncio
+import contextlib
+import functools
+import re
+import time
+
+import aiosqlite as sql # Async wrapper for sqlite
+
+from metrics import DB_STATEMENT_SECONDS, tracer
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL", # Readers and the writer don't block each other
+    "PRAGMA synchronous = NORMAL", # Safe with WAL, and much fewer fsyncs
+    "PRAGMA busy_timeout = 5000", # Wait for other processes' locks instead of failing
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000", # 16 MB page cache per connection
+]
+STATEMENT_CACHE_SIZE = 256 # Prepared statements kept per connection
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+`?(\w+)", re.IGNORECASE)
+
+# Metric label of a statement, e.g. "SELECT user_data". Queries with generated placeholder
+# lists still get one label, so the number of labels stays small.
+@functools.lru_cache(maxsize=512)
+def statement_label(query : str) -> str:
+    verb = query.split(None, 1)[0].upper() if query.strip() else ""
+    match = _TABLE.search(query)
+    return f"{verb} {match.group(1)}" if match else verb
+
+def _record(query : str, seconds : float):
+    label = statement_label(query)
+    DB_STATEMENT_SECONDS.observe(seconds, label)
+    tracer.span(f"db {label}", seconds)
+
+# What conn.execute() returns: can be awaited or used with `async with`, like aiosqlite's own
+class _TimedStatement:
+    __slots__ = ("_statement", "_query")
+
+    def __init__(self, statement, query : str):
+        self._statement = statement
+        self._query = query
+
+    async def _run(self):
+        start = time.perf_counter()
+        try:
+            return await self._statement
+        finally:
+            _record(self._query, time.perf_counter() - start)
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        try:
+            return await self._statement.__aenter__()
+        finally:
+            _record(self._query, time.perf_counter() - start)
+
+    async def __aexit__(self, *exc_info):
+        return await self._statement.__aexit__(*exc_info)
+
+class TimedConnection:
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn : sql.Connection):
+        self._conn = conn
+
+    def execute(self, query : str, params = None):
+        return _TimedStatement(self._conn.execute(query, params), query)
+
+    def executemany(self, query : str, params):
+        return _TimedStatement(self._conn.executemany(query, params), query)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+class Database:
+    def __init__(self, path : str, readers : int = 4):
+        self.path = path
+        self.reader_count = readers
+
+        self._writer = None
+        self._write_lock = None
+        self._readers = None # Queue of idle reader connections
+        self._all_readers = []
+
+    async def _connect(self):
+        # isolation_level=None: transactions are only opened by transaction() below
+        conn = await sql.connect(self.path, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    # Opens every connection and creates missing tables from the given CREATE statements
+    async def open(self, schema : list[str] = ()):
+        if self._writer is not None:
+            return
+
+        self._writer = await self._connect()
+        self._write_lock = asyncio.Lock()
+        for statement in schema:
+            await self._writer.execute(statement)
+
+        self._readers = asyncio.Queue()
+        for _ in range(self.reader_count):
+            conn = await self._connect()
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        if self._writer is None:
+            return
+
+        async with self._write_lock:
+            await self._writer.close()
+            self._writer = None
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers = []
+        self._readers = None
+
+    # Borrows a reader connection, for commands that only read
+    @contextlib.asynccontextmanager
+    async def read(self):
+        conn = await self._readers.get()
+        try:
+            yield TimedConnection(conn)
+        finally:
+            self._readers.put_nowait(conn)
+
+    # One write transaction. Everything executed on the yielded connection is committed
+    # together at the end, or rolled back if an exception escapes.
+    # BEGIN IMMEDIATE takes the write lock up front, so reads inside see the latest data.
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield TimedConnection(self._writer)
+                await self._writer.execute("COMMIT")
+            except BaseException:
+                # Also after a failed COMMIT (e.g. SQLITE_BUSY), or the writer stays inside the transaction.
+                # SQLite may have rolled back already.
+                if self._writer.in_transaction:
+                    await self._writer.execute("ROLLBACK")
+                raise
+
+    # Helpers for single statements
+    async def fetchone(self, query : str, params : tuple = ()):
+        async with self.read() as conn:
+            async with conn.execute(query, params) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, query : str, params : tuple = ()):
+        async with self.read() as conn:
+            async with conn.execute(query, params) as cursor:
+                return await cursor.fetchall()
+
+    # Returns the number of changed rows
+    async def execute(self, query : str, params : tuple = ()) -> int:
+        async with self.transaction() as conn:
+            async with conn.execute(query, params) as cursor:
+                return cursor.rowcount
+
+    async def executemany(self, query : str, params) -> int:
+        async with self.transaction() as conn:
+            async with conn.executemany(query, params) as cursor:
+                return cursor.rowcount
@@ -0,0 +1,43 @@
+# Guild registry
+# In-memory copy of guild_data (guild to challenge channel). It is loaded once at startup,
+# then every change is written to the database and applied to the dict together,
+# so a change costs one row no matter how many guilds the bot is in.
+
+import logging
+
+from database import Database
+
+log = logging.getLogger(__name__)
+
+class GuildRegistry:
+    def __init__(self, db : Database):
+        self.db = db
+        self.channels = {} # Guild ID to challenge channel ID (or None)
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __contains__(self, guild : int):
+        return guild in self.channels
+
+    # Loads every guild from the database
+    async def load(self):
+        rows = await self.db.fetchall("SELECT guild, challenge_channel FROM guild_data")
+        # Columns are TEXT, IDs are kept as ints in memory
+        self.channels = {int(row[0]): (int(row[1]) if row[1] is not None else None) for row in rows}
+        log.info(f"Guild registry loaded! ({len(self.channels)} guilds)")
+
+    def get_channel(self, guild : int) -> int | None:
+        return self.channels.get(guild)
+
+    # (guild, channel) for every guild that has a challenge channel
+    def challenge_channels(self) -> list[tuple[int, int]]:
+        return [(guild, channel) for guild, channel in self.channels.items() if channel is not None]
+
+    async def set_channel(self, guild : int, channel : int | None):
+        await self.db.execute("INSERT INTO guild_data(challenge_channel, guild) VALUES(?, ?) ON CONFLICT(guild) DO UPDATE SET challenge_channel = excluded.challenge_channel", (channel, guild))
+        self.channels[guild] = channel
+
+    async def remove(self, guild : int):
+        await self.db.execute("DELETE FROM guild_data WHERE guild = ?", (guild,))
+        self.channels.pop(guild, None)
@@ -0,0 +1,96 @@
+# Guild settings
+# Per-guild challenge configuration (ratings, post time, timezone, tag filters, contest-id floor).
+# Guilds without a row in guild_settings use the bot's defaults and share one challenge set,
+# a guild with its own settings gets its own set. Like the guild registry, every row is kept
+# in memory and changes are written through.
+
+import datetime
+import logging
+import typing
+from zoneinfo import ZoneInfo
+
+from database import Database
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS `guild_settings` (
+    `guild` INTEGER,
+    `ratings` TEXT,
+    `postTime` TEXT,
+    `timezone` TEXT,
+    `tags` TEXT,
+    `minContestId` INTEGER,
+    PRIMARY KEY(`guild`)
+)
+"""
+
+DEFAULT_SCOPE = 0 # Challenge set shared by every guild without its own settings (and DMs)
+
+LIST_SEPARATOR = ","
+TAG_SEPARATOR = ";"
+
+class ChallengeConfig(typing.NamedTuple):
+    ratings : tuple[int, ...]
+    postTime : datetime.time # Wall clock time in the timezone below
+    timezone : ZoneInfo # Also decides which date a challenge belongs to
+    tags : frozenset[str] # Problems need one of these tags, empty for any
+    minContestId : int # Only problems from later contests
+
+class GuildSettings:
+    def __init__(self, db : Database, default : ChallengeConfig):
+        self.db = db
+        self.default = default
+        self.configs = {} # Guild ID to ChallengeConfig, only guilds with their own settings
+
+    def __len__(self):
+        return len(self.configs)
+
+    def __contains__(self, guild : int):
+        return guild in self.configs
+
+    async def load(self):
+        rows = await self.db.fetchall("SELECT guild, ratings, postTime, timezone, tags, minContestId FROM guild_settings")
+        self.configs = {}
+        for row in rows:
+            try:
+                self.configs[row[0]] = self._from_row(row)
+            except (ValueError, KeyError) as e:
+                log.error(f"Error (SETTINGS): ignoring the broken settings of guild {row[0]}: {e!r}")
+        log.info(f"Guild settings loaded! ({len(self.configs)} configured guilds)")
+
+    # Columns left NULL fall back to the defaults
+    def _from_row(self, row) -> ChallengeConfig:
+        guild, ratings, postTime, timezone, tags, minContestId = row
+        return ChallengeConfig(
+            tuple(int(rating) for rating in ratings.split(LIST_SEPARATOR)) if ratings else self.default.ratings,
+            datetime.time.fromisoformat(postTime) if postTime else self.default.postTime,
+            ZoneInfo(timezone) if timezone else self.default.timezone,
+            frozenset(tags.split(TAG_SEPARATOR)) if tags else self.default.tags,
+            minContestId if minContestId is not None else self.default.minContestId,
+        )
+
+    def get(self, guild : int | None) -> ChallengeConfig:
+        return self.configs.get(guild, self.default)
+
+    # Challenge set a guild uses: its own, or the shared one
+    def scope(self, guild : int | None) -> int:
+        return guild if guild in self.configs else DEFAULT_SCOPE
+
+    # Saves a guild's settings, returns the ChallengeConfig now in effect
+    async def set(self, guild : int, config : ChallengeConfig) -> ChallengeConfig:
+        await self.db.execute("INSERT OR REPLACE INTO guild_settings(guild, ratings, postTime, timezone, tags, minContestId) VALUES(?, ?, ?, ?, ?, ?)", (
+            guild,
+            LIST_SEPARATOR.join(str(rating) for rating in config.ratings),
+            config.postTime.strftime("%H:%M"),
+            config.timezone.key,
+            TAG_SEPARATOR.join(sorted(config.tags)),
+            config.minContestId,
+        ))
+        self.configs[guild] = config
+        return config
+
+    # Back to the defaults (and the shared challenge set)
+    async def remove(self, guild : int):
+        await self.db.execute("DELETE FROM guild_settings WHERE guild = ?", (guild,))
+        self.configs.pop(guild, None)
@@ -0,0 +1,122 @@
+# Leaderboard
+# Scores are loaded once into sorted lists (one global, one per guild) and kept up to date as
+# points are awarded, so showing a page or finding a rank never touches the database.
+# Rendered pages are cached until a score in their scope changes.
+
+import bisect
+
+from database import Database
+
+SCHEMA = [
+    "CREATE INDEX IF NOT EXISTS `user_data_score` ON `user_data` (`score` DESC, `userID`)",
+    """
+    CREATE TABLE IF NOT EXISTS `guild_members` (
+        `guild` INTEGER,
+        `userID` INTEGER,
+        PRIMARY KEY(`guild`, `userID`)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS `guild_members_user` ON `guild_members` (`userID`)",
+]
+
+GLOBAL = 0 # Scope of the global ranking, guild IDs are the other scopes
+
+# Sorted list of (-score, userID), so the highest score comes first and ties go to the lower ID
+class Ranking:
+    def __init__(self):
+        self.keys = []
+        self.scores = {} # userID to score
+
+    def __len__(self):
+        return len(self.keys)
+
+    def set(self, userID : int, score : int):
+        old = self.scores.get(userID)
+        if old == score:
+            return
+        if old is not None:
+            del self.keys[bisect.bisect_left(self.keys, (-old, userID))]
+        bisect.insort(self.keys, (-score, userID))
+        self.scores[userID] = score
+
+    # 1-based rank, None if the user isn't ranked
+    def rank(self, userID : int) -> int | None:
+        score = self.scores.get(userID)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.keys, (-score, userID)) + 1
+
+    # [(rank, userID, score)] starting at a 0-based offset
+    def slice(self, offset : int, count : int) -> list[tuple[int, int, int]]:
+        return [(offset + i + 1, userID, -negScore) for i, (negScore, userID) in enumerate(self.keys[offset:offset + count])]
+
+class Leaderboard:
+    def __init__(self, db : Database, page_size : int = 10):
+        self.db = db
+        self.page_size = page_size
+
+        self.rankings = {GLOBAL: Ranking()} # Scope to Ranking
+        self.user_guilds = {} # userID to set of guilds they were seen in
+        self._pages = {} # (scope, page) to rendered page
+
+    # Loads every score and guild membership
+    async def load(self):
+        scores = await self.db.fetchall("SELECT userID, score FROM user_data WHERE codeforcesHandle IS NOT NULL")
+        members = await self.db.fetchall("SELECT guild, userID FROM guild_members")
+
+        self.rankings = {GLOBAL: Ranking()}
+        self.user_guilds = {}
+        self._pages = {}
+        for guild, userID in members:
+            self.user_guilds.setdefault(userID, set()).add(guild)
+        for userID, score in scores:
+            self._set(userID, score or 0)
+
+    def _set(self, userID, score):
+        for scope in (GLOBAL, *self.user_guilds.get(userID, ())):
+            self.rankings.setdefault(scope, Ranking()).set(userID, score)
+            self._invalidate(scope)
+
+    def _invalidate(self, scope):
+        for key in [key for key in self._pages if key[0] == scope]:
+            del self._pages[key]
+
+    # Remembers that a user belongs to a guild (they used a command there)
+    async def add_member(self, guild : int, userID : int):
+        guilds = self.user_guilds.setdefault(userID, set())
+        if guild in guilds:
+            return
+        await self.db.execute("INSERT OR IGNORE INTO guild_members(guild, userID) VALUES(?, ?)", (guild, userID))
+        guilds.add(guild)
+
+        score = self.rankings[GLOBAL].scores.get(userID)
+        if score is not None:
+            self.rankings.setdefault(guild, Ranking()).set(userID, score)
+            self._invalidate(guild)
+
+    # Adds freshly awarded points, given as {userID: points}
+    def add_points(self, credited : dict[int, int]):
+        for userID, points in credited.items():
+            self._set(userID, self.rankings[GLOBAL].scores.get(userID, 0) + points)
+
+    # Adds a newly registered user (with whatever score they already have)
+    def add_user(self, userID : int, score : int = 0):
+        if userID not in self.rankings[GLOBAL].scores:
+            self._set(userID, score)
+
+    def rank(self, scope : int, userID : int) -> int | None:
+        ranking = self.rankings.get(scope)
+        return None if ranking is None else ranking.rank(userID)
+
+    def page_count(self, scope : int) -> int:
+        ranking = self.rankings.get(scope)
+        return max(1, -(-len(ranking or ()) // self.page_size))
+
+    # Text of one page (1-based), built once and cached until a score in the scope changes
+    def render_page(self, scope : int, page : int) -> str:
+        key = (scope, page)
+        if key not in self._pages:
+            ranking = self.rankings.get(scope, Ranking())
+            rows = ranking.slice((page - 1) * self.page_size, self.page_size)
+            self._pages[key] = "\n".join(f"**#{rank}** <@{userID}> - {score}" for rank, userID, score in rows) or "Nobody has scored yet!"
+        return self._pages[key]
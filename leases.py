@@ -0,0 +1,37 @@
+# Job leases
+# When several bot processes share the database, jobs that must only run once at a time
+# (the problemset refresh, contest polling) take a lease first. A lease is a row in job_leases
+# naming its owner and when it expires. The owner renews it each run, and another process can only
+# take it over once it expired, so a crashed owner is replaced after one lease period.
+
+import os
+import socket
+import time
+
+from database import Database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS `job_leases` (
+    `name` TEXT,
+    `owner` TEXT,
+    `expiresAt` REAL,
+    PRIMARY KEY(`name`)
+)
+"""
+
+class LeaseManager:
+    def __init__(self, db : Database, owner : str | None = None):
+        self.db = db
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}" # Unique per process
+
+    # Takes or renews a lease for `ttl` seconds. Returns True if this process holds it.
+    async def acquire(self, name : str, ttl : float) -> bool:
+        now = time.time()
+        # One statement, so two processes can't both take an expired lease
+        changed = await self.db.execute("INSERT INTO job_leases(name, owner, expiresAt) VALUES(?, ?, ?) ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expiresAt = excluded.expiresAt WHERE owner = excluded.owner OR expiresAt < ?",
+                                        (name, self.owner, now + ttl, now))
+        return changed > 0
+
+    # Gives a lease up early (e.g. on shutdown), if this process holds it
+    async def release(self, name : str):
+        await self.db.execute("DELETE FROM job_leases WHERE name = ? AND owner = ?", (name, self.owner))
@@ -0,0 +1,210 @@
+# Score ledger
+# Every credited challenge is appended to challenge_completions, one row per user per date (the
+# primary key), so the same completion can never be credited twice, and rows are never changed.
+# Totals, streaks and weekly/monthly sums are kept up to date in user_stats and period_scores as
+# completions are appended, so history and streak queries are index lookups. They can always be
+# recomputed from the ledger with rebuild():
+#   python ledger.py --rebuild
+
+import argparse
+import asyncio
+import datetime
+import typing
+
+from database import Database
+
+SCHEMA = [
+    # WITHOUT ROWID: rows are stored in (userID, date) order, a user's history is one range read
+    """
+    CREATE TABLE IF NOT EXISTS `challenge_completions` (
+        `userID` INTEGER NOT NULL,
+        `date` TEXT NOT NULL,
+        `guild` INTEGER NOT NULL DEFAULT 0,
+        `rating` INTEGER NOT NULL,
+        `points` INTEGER NOT NULL,
+        `submissionId` INTEGER,
+        `creditedAt` TEXT NOT NULL,
+        PRIMARY KEY(`userID`, `date`)
+    ) WITHOUT ROWID
+    """,
+    # Covering indexes for date ranges, globally and per guild
+    "CREATE INDEX IF NOT EXISTS `challenge_completions_date` ON `challenge_completions` (`date`, `userID`, `points`)",
+    "CREATE INDEX IF NOT EXISTS `challenge_completions_guild` ON `challenge_completions` (`guild`, `date`, `userID`, `points`)",
+    "CREATE TRIGGER IF NOT EXISTS `challenge_completions_no_update` BEFORE UPDATE ON `challenge_completions` BEGIN SELECT RAISE(ABORT, 'challenge_completions is append-only'); END",
+    "CREATE TRIGGER IF NOT EXISTS `challenge_completions_no_delete` BEFORE DELETE ON `challenge_completions` BEGIN SELECT RAISE(ABORT, 'challenge_completions is append-only'); END",
+    # legacyScore: points a user had before the ledger existed (or was imported with), score = legacyScore + total
+    """
+    CREATE TABLE IF NOT EXISTS `user_stats` (
+        `userID` INTEGER,
+        `legacyScore` INTEGER NOT NULL DEFAULT 0,
+        `total` INTEGER NOT NULL DEFAULT 0,
+        `completions` INTEGER NOT NULL DEFAULT 0,
+        `currentStreak` INTEGER NOT NULL DEFAULT 0,
+        `longestStreak` INTEGER NOT NULL DEFAULT 0,
+        `lastDate` TEXT,
+        PRIMARY KEY(`userID`)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS `user_stats_longest` ON `user_stats` (`longestStreak` DESC, `userID`)",
+    # Period is an ISO week ("2025-W04") or a month ("2025-01")
+    """
+    CREATE TABLE IF NOT EXISTS `period_scores` (
+        `period` TEXT,
+        `userID` INTEGER,
+        `points` INTEGER NOT NULL,
+        PRIMARY KEY(`period`, `userID`)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS `period_scores_points` ON `period_scores` (`period`, `points` DESC, `userID`)",
+]
+
+MAX_ROWS_PER_STATEMENT = 1000 # Keeps multi-row INSERTs well under sqlite's variable limit
+
+class Completion(typing.NamedTuple):
+    rating : int
+    guild : int = 0 # Where it was completed, 0 outside of servers or when unknown
+    submissionId : int | None = None
+
+class UserStats(typing.NamedTuple):
+    total : int # Points in the ledger
+    completions : int
+    currentStreak : int # 0 once a day was missed
+    longestStreak : int
+    lastDate : datetime.date | None
+
+# The week and month a date counts towards
+def periods(date : datetime.date) -> tuple[str, str]:
+    year, week, _ = date.isocalendar()
+    return (f"{year}-W{week:02}", f"{date.year}-{date.month:02}")
+
+# Records users that have points but no user_stats row yet (points from before the ledger, or imported)
+# as their legacy score, so totals from the ledger add up to user_data.score.
+async def migrate(conn):
+    await conn.execute("INSERT OR IGNORE INTO user_stats(userID, legacyScore) SELECT userID, score FROM user_data WHERE score > 0")
+
+# Makes user_data.score the truth again after scores were written directly (e.g. imported):
+# whatever the ledger doesn't account for becomes the legacy score.
+async def sync_legacy_scores(conn):
+    await migrate(conn)
+    await conn.execute("UPDATE user_stats SET legacyScore = MAX(0, COALESCE((SELECT score FROM user_data WHERE user_data.userID = user_stats.userID), 0) - total)")
+
+# Appends completions of one date, inside the caller's transaction, and updates the aggregates.
+# credits is a dict of {userID: (Completion, points)}. Users who already have a row for the date are
+# skipped by the primary key. Returns a dict of {userID: points} for the rows that were appended.
+async def append(conn, date : datetime.date, credits : dict[int, tuple[Completion, int]]) -> dict[int, int]:
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    rows = [(userID, date.isoformat(), completion.guild, completion.rating, points, completion.submissionId, now) for userID, (completion, points) in credits.items()]
+
+    appended = {}
+    for i in range(0, len(rows), MAX_ROWS_PER_STATEMENT):
+        chunk = rows[i:i + MAX_ROWS_PER_STATEMENT]
+        values = ", ".join(["(?, ?, ?, ?, ?, ?, ?)"] * len(chunk))
+        async with conn.execute(f"INSERT OR IGNORE INTO challenge_completions(userID, date, guild, rating, points, submissionId, creditedAt) VALUES {values} RETURNING userID, points",
+                                [value for row in chunk for value in row]) as cursor:
+            appended.update(await cursor.fetchall())
+    if not appended:
+        return {}
+
+    # Streaks continue if the previous completion was the day before
+    user_ids = list(appended)
+    placeholders = ", ".join("?" * len(user_ids))
+    async with conn.execute(f"SELECT userID, currentStreak, lastDate FROM user_stats WHERE userID IN ({placeholders})", user_ids) as cursor:
+        previous = {userID: (streak, lastDate) for userID, streak, lastDate in await cursor.fetchall()}
+
+    yesterday = (date - datetime.timedelta(days=1)).isoformat()
+    stats = []
+    for userID, points in appended.items():
+        streak, lastDate = previous.get(userID, (0, None))
+        streak = streak + 1 if lastDate == yesterday else 1
+        stats.append((userID, points, streak, streak, date.isoformat()))
+    await conn.executemany("""INSERT INTO user_stats(userID, total, completions, currentStreak, longestStreak, lastDate) VALUES(?, ?, 1, ?, ?, ?)
+                              ON CONFLICT(userID) DO UPDATE SET total = total + excluded.total, completions = completions + 1, currentStreak = excluded.currentStreak,
+                              longestStreak = MAX(longestStreak, excluded.longestStreak), lastDate = excluded.lastDate""", stats)
+
+    await conn.executemany("INSERT INTO period_scores(period, userID, points) VALUES(?, ?, ?) ON CONFLICT(period, userID) DO UPDATE SET points = points + excluded.points",
+                           [(period, userID, points) for userID, points in appended.items() for period in periods(date)])
+    return appended
+
+# Read-only queries over the ledger and its aggregates
+class ScoreLedger:
+    def __init__(self, db : Database):
+        self.db = db
+
+    # Totals and streaks of a user. A streak is still current if the last completion was on `today` or the day before.
+    async def stats(self, userID : int, today : datetime.date) -> UserStats:
+        row = await self.db.fetchone("SELECT total, completions, currentStreak, longestStreak, lastDate FROM user_stats WHERE userID = ?", (userID,))
+        if row is None or row[4] is None:
+            return UserStats(0, 0, 0, 0, None)
+        lastDate = datetime.date.fromisoformat(row[4])
+        current = row[2] if lastDate >= today - datetime.timedelta(days=1) else 0
+        return UserStats(row[0], row[1], current, row[3], lastDate)
+
+    # A user's completions, newest first: [(date, guild, rating, points, submissionId)]
+    async def history(self, userID : int, limit : int = 30) -> list[tuple]:
+        return await self.db.fetchall("SELECT date, guild, rating, points, submissionId FROM challenge_completions WHERE userID = ? ORDER BY date DESC LIMIT ?", (userID, limit))
+
+    # Best users of a week or month (see periods()): [(userID, points)]
+    async def period_top(self, period : str, limit : int = 10) -> list[tuple[int, int]]:
+        return await self.db.fetchall("SELECT userID, points FROM period_scores WHERE period = ? ORDER BY points DESC, userID LIMIT ?", (period, limit))
+
+    # Points per user completed in a guild between two dates (inclusive): [(userID, points)]
+    async def guild_top(self, guild : int, start : datetime.date, end : datetime.date, limit : int = 10) -> list[tuple[int, int]]:
+        return await self.db.fetchall("SELECT userID, SUM(points) AS total FROM challenge_completions WHERE guild = ? AND date BETWEEN ? AND ? GROUP BY userID ORDER BY total DESC, userID LIMIT ?",
+                                      (guild, start.isoformat(), end.isoformat(), limit))
+
+    # Longest streaks ever: [(userID, longestStreak)]
+    async def longest_streaks(self, limit : int = 10) -> list[tuple[int, int]]:
+        return await self.db.fetchall("SELECT userID, longestStreak FROM user_stats WHERE longestStreak > 0 ORDER BY longestStreak DESC, userID LIMIT ?", (limit,))
+
+    # Recomputes user_stats, period_scores and user_data.score from the ledger, in one transaction.
+    # Returns the number of users with completions.
+    async def rebuild(self) -> int:
+        async with self.db.transaction() as conn:
+            await migrate(conn)
+            async with conn.execute("SELECT userID, date, points FROM challenge_completions ORDER BY userID, date") as cursor:
+                rows = await cursor.fetchall()
+
+            stats = {} # userID to [total, completions, currentStreak, longestStreak, lastDate]
+            period_points = {}
+            for userID, date, points in rows:
+                day = datetime.date.fromisoformat(date)
+                entry = stats.get(userID)
+                if entry is None:
+                    entry = stats[userID] = [0, 0, 0, 0, None]
+                entry[0] += points
+                entry[1] += 1
+                entry[2] = entry[2] + 1 if entry[4] == (day - datetime.timedelta(days=1)).isoformat() else 1
+                entry[3] = max(entry[3], entry[2])
+                entry[4] = date
+                for period in periods(day):
+                    period_points[(period, userID)] = period_points.get((period, userID), 0) + points
+
+            await conn.execute("UPDATE user_stats SET total = 0, completions = 0, currentStreak = 0, longestStreak = 0, lastDate = NULL")
+            await conn.executemany("""INSERT INTO user_stats(userID, total, completions, currentStreak, longestStreak, lastDate) VALUES(?, ?, ?, ?, ?, ?)
+                                      ON CONFLICT(userID) DO UPDATE SET total = excluded.total, completions = excluded.completions, currentStreak = excluded.currentStreak,
+                                      longestStreak = excluded.longestStreak, lastDate = excluded.lastDate""",
+                                   [(userID, *entry) for userID, entry in stats.items()])
+            await conn.execute("DELETE FROM period_scores")
+            await conn.executemany("INSERT INTO period_scores(period, userID, points) VALUES(?, ?, ?)", [(period, userID, points) for (period, userID), points in period_points.items()])
+            await conn.execute("UPDATE user_data SET score = COALESCE((SELECT legacyScore + total FROM user_stats WHERE user_stats.userID = user_data.userID), 0)")
+        return len(stats)
+
+async def run_rebuild(path : str):
+    db = Database(path, readers=1)
+    await db.open(schema=SCHEMA)
+    try:
+        users = await ScoreLedger(db).rebuild()
+        print(f"Rebuilt the aggregates of {users} users from the ledger")
+    finally:
+        await db.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Maintenance of the challenge score ledger.")
+    parser.add_argument("--db", default="database.db")
+    parser.add_argument("--rebuild", action="store_true", help="recompute totals, streaks, period sums and scores from challenge_completions")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.rebuild:
+        asyncio.run(run_rebuild(args.db))
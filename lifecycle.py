@@ -0,0 +1,93 @@
+# Lifecycle
+# Startup and shutdown run as named async hooks, in the order they were registered. A failing
+# startup hook stops the start (shutdown hooks still run, so they must cope with a partial start).
+# A failing or slow shutdown hook is logged and the next one still runs, so a stuck Codeforces
+# request never keeps the database from being closed.
+# run() installs SIGINT/SIGTERM handlers that turn a signal into an orderly shutdown.
+
+import asyncio
+import logging
+import signal
+import time
+import typing
+
+log = logging.getLogger(__name__)
+
+Hook = typing.Callable[[], typing.Awaitable[None]]
+
+class Lifecycle:
+    def __init__(self, shutdown_timeout : float = 30):
+        self.shutdown_timeout = shutdown_timeout # Default seconds each shutdown hook gets
+
+        self._startup = [] # (name, hook)
+        self._shutdown = [] # (name, hook, timeout)
+        self._started = False
+        self._main_task = None
+
+    # Decorators registering a hook
+    def on_startup(self, name : str):
+        def register(hook : Hook) -> Hook:
+            self._startup.append((name, hook))
+            return hook
+        return register
+
+    def on_shutdown(self, name : str, timeout : float | None = None):
+        def register(hook : Hook) -> Hook:
+            self._shutdown.append((name, hook, timeout if timeout is not None else self.shutdown_timeout))
+            return hook
+        return register
+
+    async def start(self):
+        self._started = True # Even if a hook fails, stop() cleans up after the ones that ran
+        for name, hook in self._startup:
+            start = time.perf_counter()
+            await hook()
+            log.info(f"Startup: {name} took {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    async def stop(self):
+        if not self._started:
+            return
+        self._started = False
+        for name, hook, timeout in self._shutdown:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(hook(), timeout)
+            except asyncio.TimeoutError:
+                log.warning(f"Warning (SHUTDOWN): {name} did not finish within {timeout}s, skipped")
+                continue
+            except Exception:
+                log.exception(f"Error (SHUTDOWN): {name} failed")
+                continue
+            log.info(f"Shutdown: {name} took {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def _request_stop(self, signame : str):
+        if self._main_task is not None and not self._main_task.done():
+            log.info(f"Received {signame}, shutting down")
+            self._main_task.cancel()
+            self._main_task = None # A second signal while shutting down is ignored
+
+    # Starts, runs serve() until it returns or the process is signalled, then shuts down
+    async def run(self, serve : Hook):
+        loop = asyncio.get_running_loop()
+        current = asyncio.current_task()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._request_stop, sig.name)
+            except NotImplementedError: # Windows
+                pass
+
+        try:
+            await self.start()
+            self._main_task = asyncio.ensure_future(serve())
+            await self._main_task
+        except asyncio.CancelledError:
+            if current.cancelling():
+                current.uncancel() # The shutdown below still has to await
+        finally:
+            self._main_task = None
+            await self.stop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.remove_signal_handler(sig)
+                except NotImplementedError:
+                    pass
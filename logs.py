@@ -0,0 +1,30 @@
+# Logging
+# Log calls only put the record on a queue. A QueueListener thread does the formatting and the
+# file writes, so a slow disk never stalls the event loop. The file is rotated by size and
+# appended to across restarts, instead of being truncated on every start.
+
+import atexit
+import logging
+import logging.handlers
+import queue
+
+FORMAT = "%(asctime)s:%(levelname)s:%(name)s: %(message)s"
+
+def setup_logging(path : str = "bot.log", max_bytes : int = 10 * 1024 * 1024, backups : int = 5, console_level : int = logging.INFO) -> logging.handlers.QueueListener:
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(console_level)
+    console_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s: %(message)s"))
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop) # Flushes what's still queued
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    logging.getLogger("disnake").setLevel(logging.DEBUG) # Same detail as the old disnake.log
+    return listener
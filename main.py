@@ -14,39 +14,142 @@ from zoneinfo import ZoneInfo
 import datetime
 
 # Database interaction
-import aiosqlite as sql # Async wrapper for sqlite
+from database import Database
 
-# Logging
+# Logging, metrics and tracing
 import logging
+from logs import setup_logging
+from metrics import COMMAND_SECONDS, CF_QUEUE_DEPTH, tracer, start_server as start_metrics_server
 
-# Async Request
-import aiohttp
+# Codeforces API
+from cf_api import CodeforcesClient, PRIORITY_INTERACTIVE
+
+# Guild registry
+from guild_registry import GuildRegistry
+
+# Problem catalog
+from problemset import Problem, ProblemCatalog, SCHEMA as PROBLEMSET_SCHEMA, STATS_SCHEMA as PROBLEM_STATS_SCHEMA
+
+# Per-guild challenge settings and selection
+from guild_settings import ChallengeConfig, GuildSettings, DEFAULT_SCOPE, SCHEMA as SETTINGS_SCHEMA
+from challenges import ChallengeSelector, migrate as migrate_challenges, SCHEMA as CHALLENGES_SCHEMA
+from scheduler import ChallengeScheduler
+
+# Running as several processes
+from sharding import ShardConfig
+from leases import LeaseManager, SCHEMA as LEASES_SCHEMA
+
+# Profile cache
+from profiles import ProfileCache
+
+# Submission checks
+from verification import SubmissionVerifier
+
+# Scoring and automatic crediting
+from scoring import credit_challenges
+from ledger import Completion, ScoreLedger, migrate as migrate_ledger, SCHEMA as LEDGER_SCHEMA
+from contest_poller import ContestPoller, SCHEMA as POLLER_SCHEMA
+
+# Registration
+from registration import RegistrationVerifier, SCHEMA as REGISTRATION_SCHEMA
+
+# Leaderboard
+from leaderboard import Leaderboard, GLOBAL, SCHEMA as LEADERBOARD_SCHEMA
+
+# Challenge broadcast
+from broadcast import ChallengeBroadcaster, SCHEMA as BROADCAST_SCHEMA
+
+# Problem recommendations
+from recommend import Recommender
+
+# Startup and shutdown
+from lifecycle import Lifecycle
 
 # Miscellaneous
-import typing
-import random
+from zoneinfo import ZoneInfoNotFoundError
 
 # Important constants
 TIMEZONE = ZoneInfo("Asia/Singapore")
 UTC = ZoneInfo("UTC")
 DB = "database.db"
+DB_READERS = 4 # Pooled read connections
+load_dotenv() # The settings below may come from .env too
+SHARDS = ShardConfig.from_env() # SHARD_COUNT and SHARD_IDS, unset for one unsharded process
+CF_COORDINATOR_URL = os.environ.get("CF_COORDINATOR_URL") # API base of cf_coordinator.py, to share one rate limit between processes
+COORDINATOR_TIMEOUT = 300 # Seconds a request may wait in the coordinator's queue
+LEADERBOARD_SYNC_INTERVAL = 60 # Seconds between leaderboard reloads, when other processes award points too
 REQUEST_DELAY = 2 # Delay between requests
+REQUEST_BURST = 1 # Requests that may be sent back to back after an idle period
 
 # Settings
 CHALLENGE_TIME = datetime.time(hour=21, minute=0, second=0, tzinfo=UTC)
 CHALLENGE_RATINGS = [800, 1000, 1200, 1400, 1600, 1800, 2000, 2200, 2400, 2600, 2800, 3000, 3200, 3400]
 MIN_CHALLENGE_CONTEST_ID = 1000
+CHALLENGE_RATING_RANGE = (800, 3500) # Ratings guilds may pick in /challenge_settings
+CHALLENGE_SPREAD = 300 # Seconds guilds with the same post time are spread over
+PROBLEMSET_REFRESH_HOURS = 12 # How often the local problem catalog is refreshed
+BROADCAST_CONCURRENCY = 10 # Challenge posts in flight at once
+BROADCAST_RETRY_INTERVAL = 120 # Seconds between retries of challenge posts that failed (e.g. a Discord 5xx)
+SUBMISSION_CACHE_TTL = 5 # Seconds a handle's fetched submissions are reused for
+SUBMISSION_WINDOW = 30 # Recent submissions checked per handle
+AUTO_CREDIT_CHALLENGES = False # Poll the challenge contests and credit solves without /complete_challenge
+AUTO_CREDIT_INTERVAL = 120 # Seconds between polls
+REGISTER_TIMEOUT = 60 # Seconds a user has to submit the Compile Error in /register
+REGISTER_POLL_INTERVAL = 5 # Seconds between checks of pending registrations
+LEADERBOARD_PAGE_SIZE = 10 # Users per /leaderboard page
+PROFILE_CACHE_TTL = 600 # Seconds a Codeforces profile is reused for
+PROFILE_CACHE_SIZE = 5000 # Profiles kept in memory
+PROFILE_BATCH_WINDOW = 0.05 # Seconds profile lookups are collected into one user.info request
+LOG_FILE = "bot.log" # Rotated once it reaches LOG_MAX_BYTES, LOG_BACKUPS old files are kept
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108)) # /metrics and /traces, 0 disables. Give each shard process its own.
+SLOW_COMMAND_SECONDS = 2 # Commands slower than this are logged with their trace
+SNAPSHOT_DIR = "snapshots" # Problem catalog and profile cache are saved here on shutdown
+SHUTDOWN_TIMEOUT = 30 # Seconds each shutdown step may take
+CF_DRAIN_TIMEOUT = 10 # Seconds queued Codeforces requests get to finish on shutdown
+RECOMMEND_STRETCH = 100 # /recommend aims this far above the user's rating
+RECOMMEND_CACHE_SIZE = 1000 # Submission histories /recommend keeps in memory
+
+# What guilds get until they change it with /challenge_settings
+DEFAULT_CHALLENGE_CONFIG = ChallengeConfig(
+    tuple(CHALLENGE_RATINGS),
+    datetime.datetime.combine(datetime.date.today(), CHALLENGE_TIME).astimezone(TIMEZONE).time().replace(tzinfo=None), # CHALLENGE_TIME on TIMEZONE's clock
+    TIMEZONE,
+    frozenset(),
+    MIN_CHALLENGE_CONTEST_ID,
+)
 
 # Global variables
-challenge_channel_id = {} # Dictionary of guild to challenge channel
-challenge_guilds = [] # List of all challenge guilds
+db = Database(DB, DB_READERS) # Shared by every command and task
+guilds = GuildRegistry(db) # Guild to challenge channel
+settings = GuildSettings(db, DEFAULT_CHALLENGE_CONFIG) # Per-guild challenge configuration
+if CF_COORDINATOR_URL is None:
+    cf_client = CodeforcesClient(rate=1/REQUEST_DELAY, burst=REQUEST_BURST) # Shared by every command and task
+else:
+    # The coordinator enforces the real limit and retries 429s, this process only forwards
+    cf_client = CodeforcesClient(CF_COORDINATOR_URL, rate=100, burst=100, max_retries=1, timeout=COORDINATOR_TIMEOUT, forward_priority=True)
+leases = LeaseManager(db) # Jobs only one process runs
+profiles = ProfileCache(cf_client, PROFILE_CACHE_TTL, PROFILE_CACHE_SIZE, PROFILE_BATCH_WINDOW) # user.info per handle
+verifier = SubmissionVerifier(cf_client, SUBMISSION_CACHE_TTL, SUBMISSION_WINDOW) # Recent submissions per handle
+registrations = RegistrationVerifier(db, verifier, REGISTER_TIMEOUT, REGISTER_POLL_INTERVAL) # Pending /register verifications
+register_interactions = {} # userID to the /register interaction, to edit it once verification finishes
+leaderboard = Leaderboard(db, LEADERBOARD_PAGE_SIZE) # In-memory rankings
+ledger = ScoreLedger(db) # Completion history, totals and streaks
+poller = ContestPoller(db, cf_client) # Automatic crediting (if enabled)
+catalog = ProblemCatalog(db, cf_client, datetime.timedelta(hours=PROBLEMSET_REFRESH_HOURS), MIN_CHALLENGE_CONTEST_ID) # Local problemset
+selector = ChallengeSelector(catalog) # Non-repeating challenge draws
+scheduler = ChallengeScheduler(settings, CHALLENGE_SPREAD) # When each guild's challenge is posted
+recommender = Recommender(catalog, profiles, verifier, cf_client, RECOMMEND_CACHE_SIZE, RECOMMEND_STRETCH) # /recommend
+lifecycle = Lifecycle(SHUTDOWN_TIMEOUT) # Ordered startup and shutdown steps
+cache_warmup = None # Loads the snapshots in the background after startup
 
-# Logging
-logger = logging.getLogger('disnake')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='disnake.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
+# Logging, metrics and tracing
+log = logging.getLogger("main")
+tracer.slow_threshold = SLOW_COMMAND_SECONDS
+CF_QUEUE_DEPTH.set_function(cf_client.queue_depth)
+metrics_server = None # Started once the bot is ready
 
 # Utility functions
 def grab_token():
@@ -60,120 +163,49 @@ def grab_token():
     else:
         raise Exception("grab_token() failed. Bot token not found. Does .env exist in the same folder as main.py and have a BOT_TOKEN environment variable?")
 
-async def fetch_challenge_data():
-    
-    global challenge_channel_id
-    global challenge_guilds
-    
-    challenge_guilds = []
-    challenge_channel_id = {}
-    
-    async with sql.connect(DB) as db:
-        async with db.execute("SELECT guild, challenge_channel FROM guild_data") as cursor:
-            values = await cursor.fetchall()
-            for row in values:
-                challenge_guilds.append(row[0])
-                challenge_channel_id[ row[0] ] = row[1]
-    
-    print("Challenge data fetched!")
-    
-async def get_scoring(rating):
-    return 10 + (rating-800)//100
-
 # Gets Codeforces url from contestId and index 
 async def get_cf_url(contestID, index):
     return f"https://codeforces.com/problemset/problem/{contestID}/{index}"
 
-# Given a list of tuples of {slugs (str), parameters (dicts)}, return an ordered list of responses.
-# If successful, a dict (parsed json) will be returned
-# Otherwise, the status code is returned
-async def make_cf_requests(requests : list[tuple[str, dict]]) -> list[dict | int]:
-    responses = []
-    async with aiohttp.ClientSession('https://codeforces.com/api/') as session:
-        for req in requests:
-            async with session.get(req[0], params=req[1]) as resp:
-                status = resp.status
-                
-                if 200 <= status and status <= 299: # 2XX successful
-                    responses.append( await resp.json() )
-                else:
-                    responses.append(status)
-            
-            await asyncio.sleep(REQUEST_DELAY) # Delay requests
-    
-    return responses
+# Generates the challenge sets of the given scopes
+# In particular, returns a dict of {scope: {rating: Problem}}
+# Only draws from the loaded catalog, so it can run inside a transaction (callers load it first)
+async def generate_challenge_sets(scopes):
+    return {scope: selector.draw(scope, settings.get(scope)) for scope in scopes}
 
-# Updates database for new codeforces handle
-async def db_update_handle(userID, handle):
-    async with sql.connect(DB) as db:
-        await db.execute("UPDATE OR IGNORE user_data SET codeforcesHandle = ? WHERE userID = ?", (handle, userID))
-        await db.execute("INSERT OR IGNORE INTO user_data(userID, codeforcesHandle, score) VALUES(?, ?, ?)", (userID, handle, 0))
-        await db.commit()
-        
-# Generates challenge set
-# In particular, returns a dict of {rating: problemJSON}
-async def generate_challenge_set():
-    candidates = {}
-    # Rating to list of jsons
-    
-    pset_req = ("problemset.problems", {})
-    pset_result = (await make_cf_requests([pset_req]))[0]
-    
-    while True:
-        if isinstance(pset_result, int):
-            print(f"Error (CHALLENGE PSET): Codeforces responded with a status code of {pset_result}!")
-            await asyncio.sleep(60)
-            continue
-        elif pset_result["status"] != "OK":
-            print(f"Error (CHALLENGE PSET): Codeforces responded with a status string of {pset_result['status']}!")
-            await asyncio.sleep(60)
-            continue
-        else:
-            pset_result = pset_result["result"]["problems"]
-            
-            for problem in pset_result:
-                if "contestId" not in problem:
-                    # Reject due to no contestID
-                    continue
-                
-                if "rating" not in problem:
-                    # Reject due to no rating
-                    continue
-                
-                '''
-                if "type" not in problem or problem["type"] != "CF":
-                    # Reject non-CF (ICPC or IOI or ...)
-                    continue
-                '''  
-                
-                try:
-                    if problem["contestId"] <= MIN_CHALLENGE_CONTEST_ID:
-                        # Reject due to too low contestID (recency check)
-                        continue
-                except:
-                    continue # Not even a normal contestID
-                
-                if problem["rating"] not in candidates:
-                    candidates[problem["rating"]] = []
-                
-                candidates[problem["rating"]].append(problem)   
-                
-            break                 
+# Reads every challenge set of a date back from the database, in the same format as generate_challenge_sets
+# Reads on conn if given (e.g. inside a transaction)
+async def db_get_challenge_sets(date, conn = None):
+    if conn is None:
+        await catalog.ensure_loaded() # For the problem names (inside a transaction, the caller has loaded it)
+        rows = await db.fetchall("SELECT guild, rating, problemContestID, problemIndex FROM challenge_data WHERE date = ?", (date.isoformat(),))
+    else:
+        async with conn.execute("SELECT guild, rating, problemContestID, problemIndex FROM challenge_data WHERE date = ?", (date.isoformat(),)) as cursor:
+            rows = await cursor.fetchall()
     
-    challenge_set = {}
-    for rating in CHALLENGE_RATINGS:
-        challenge_set[rating] = candidates[rating][random.randint(0, len(candidates[rating]) - 1)]
-        
-    return challenge_set
+    challenge_sets = {}
+    for guild, rating, contestID, index in rows:
+        problem = catalog.get(contestID, index)
+        if problem is None:
+            problem = Problem(contestID, index, f"{contestID}{index}", rating, ()) # Not in the catalog (anymore)
+        challenge_sets.setdefault(int(guild), {})[rating] = problem
+    
+    return challenge_sets
+
+# The challenge set of one scope ({rating: Problem}), the shared one if the scope has none that date
+async def db_get_challenge_set(date, scope = DEFAULT_SCOPE):
+    challenge_sets = await db_get_challenge_sets(date)
+    return challenge_sets.get(scope, challenge_sets.get(DEFAULT_SCOPE, {}))
 
-async def create_challenge_set_embed(challenge_set):
-    cur_date = datetime.datetime.now(tz=TIMEZONE).date()
+async def create_challenge_set_embed(challenge_set, cur_date = None):
+    if cur_date is None:
+        cur_date = datetime.datetime.now(tz=TIMEZONE).date()
     challenge_description = ""
-    for rating in CHALLENGE_RATINGS:
+    for rating in sorted(challenge_set):
         problem = challenge_set[rating]
-        cf_url = await get_cf_url(problem["contestId"], problem["index"])
+        cf_url = await get_cf_url(problem.contestId, problem.index)
         challenge_description += f"# {rating}-rating!\n"
-        challenge_description += f"[{problem['name']}]({cf_url})\n"
+        challenge_description += f"[{problem.name}]({cf_url})\n"
                 
     dateString = cur_date.isoformat()
         
@@ -189,16 +221,63 @@ async def create_challenge_set_embed(challenge_set):
 # Create bot for slash commands
 command_sync_flags = commands.CommandSyncFlags.default()
 command_sync_flags.sync_commands_debug = True
-bot = commands.InteractionBot(
+bot_class = commands.AutoShardedInteractionBot if SHARDS.shard_count else commands.InteractionBot
+bot = bot_class(
     command_sync_flags=command_sync_flags,
+    **SHARDS.bot_kwargs(),
     # test_guilds=[593099338096574466], # Personal Test Server ID
 )
 
+broadcaster = ChallengeBroadcaster(bot, db, BROADCAST_CONCURRENCY) # Sends the daily challenge
+
 # Bot Startup
 @bot.event
 async def on_ready():
-    challenge_update.start()
-    print("The bot is ready!")
+    global metrics_server
+    if METRICS_PORT and metrics_server is None:
+        metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    if not problemset_refresh.is_running():
+        problemset_refresh.start()
+    if not registration_check.is_running():
+        registration_check.start()
+    if AUTO_CREDIT_CHALLENGES and not auto_credit.is_running():
+        auto_credit.start()
+    if SHARDS.partial and not leaderboard_sync.is_running():
+        leaderboard_sync.start()
+    if not challenge_schedule.is_running():
+        await resume_challenge_broadcast() # In case the last broadcast was interrupted
+        challenge_schedule.start()
+    if not broadcast_retry.is_running():
+        broadcast_retry.start()
+    log.info("The bot is ready!")
+
+# Every slash command is timed, with the Codeforces requests and database statements it made as its trace.
+# Both hooks run in the command's own task, so the trace follows it into the clients.
+@bot.before_slash_command_invoke
+async def start_command_trace(ctx : disnake.ApplicationCommandInteraction):
+    tracer.start(f"/{ctx.application_command.qualified_name}")
+
+@bot.after_slash_command_invoke
+async def finish_command_trace(ctx : disnake.ApplicationCommandInteraction):
+    trace = tracer.current()
+    if trace is not None:
+        status = "error" if ctx.command_failed else "ok"
+        COMMAND_SECONDS.observe(tracer.finish(trace, status), ctx.application_command.qualified_name, status)
+
+# Forget guilds the bot was removed from
+@bot.event
+async def on_guild_remove(guild : disnake.Guild):
+    if guild.id in guilds:
+        await guilds.remove(guild.id)
+    if guild.id in settings:
+        await settings.remove(guild.id)
+    scheduler.unschedule(guild.id)
+
+# Remember which servers users are in, for the per-server leaderboard
+@bot.event
+async def on_slash_command(ctx : disnake.ApplicationCommandInteraction):
+    if ctx.guild_id is not None:
+        await leaderboard.add_member(ctx.guild_id, ctx.author.id)
 
 # IMPORTANT
 # Commands!
@@ -218,20 +297,16 @@ async def info(ctx : disnake.ApplicationCommandInteraction):
     # CF Username
     CF_user = None
     score = 0
-    async with sql.connect(DB) as db:
-        async with db.execute("SELECT codeforcesHandle, score FROM user_data WHERE userID = ?", (auth_id,)) as cursor:
-            value = await cursor.fetchone()
-            if value is not None:
-                CF_user = value[0]
-                if value[1] is not None:
-                    score = value[1]
+    value = await db.fetchone("SELECT codeforcesHandle, score FROM user_data WHERE userID = ?", (auth_id,))
+    if value is not None:
+        CF_user = value[0]
+        if value[1] is not None:
+            score = value[1]
                 
     info += f"# {CF_user}\n"
     
     if CF_user is not None:
-        user_req = ("user.info", {"handles": f"{CF_user}"})
-        res = (await make_cf_requests([user_req]))
-        user_result = res[0]
+        user_result = await profiles.get(CF_user, PRIORITY_INTERACTIVE)
         
         rank = ""
         max_rank = ""
@@ -239,20 +314,22 @@ async def info(ctx : disnake.ApplicationCommandInteraction):
         # Handle user_result
         if isinstance(user_result, int):
             info += f"Error (USER): Codeforces responded with a status code of {user_result}!\nThe API may be down, do not contact Shor for this error unless you are sure it is a problem with the bot.\n"
-        elif user_result["status"] != "OK":
+        elif "status" in user_result:
             info += f"Error (USER): Codeforces responded with a status string of { user_result['status'] }!\nCheck that your handle is correct, the API may also be down.\n"
         else:
-            user_result = user_result["result"][0]
-            
             avatar_url = user_result["avatar"]
-            rank = user_result["rank"]
-            max_rank = user_result["maxRank"]
+            rank = user_result.get("rank", "unrated")
+            max_rank = user_result.get("maxRank", "unrated")
             
             info += f"Rank: {rank}\n"
             info += f"Max Rank: {max_rank}\n"
     
     info += f"Challenge Score: {score}\n"
     
+    if CF_user is not None:
+        stats = await ledger.stats(auth_id, scheduler.current_date(ctx.guild_id) or datetime.datetime.now(tz=TIMEZONE).date())
+        info += f"Challenge Streak: {stats.currentStreak} (best {stats.longestStreak})\n"
+    
     info = info.strip()
     
     embed = disnake.Embed(
@@ -272,11 +349,7 @@ async def register(ctx : disnake.ApplicationCommandInteraction, cf_handle : str)
     await ctx.response.defer()
     
     auth = ctx.author
-    user_req = ("user.info", {"handles": f"{cf_handle}"})
-    pset_req = ("problemset.problems", {})
-    res = (await make_cf_requests([user_req, pset_req]))
-    user_result = res[0]
-    pset_result = res[1]
+    user_result = await profiles.get(cf_handle, PRIORITY_INTERACTIVE)
     
     avatar_url = ""
     rank = None
@@ -286,42 +359,26 @@ async def register(ctx : disnake.ApplicationCommandInteraction, cf_handle : str)
     if isinstance(user_result, int):
         await ctx.edit_original_response(content=f"Error (USER): Codeforces responded with a status code of {user_result}!\nThe API may be down, do not contact Shor for this error unless you are sure it is a problem with the bot.")
         return
-    elif user_result["status"] != "OK":
+    elif "status" in user_result:
         await ctx.edit_original_response(f"Error (USER): Codeforces responded with a status string of { user_result['status'] }!\nCheck that your handle is correct, the API may also be down.")
         return
     else:
-        user_result = user_result["result"][0]
-        
         avatar_url = user_result["avatar"]
-        if rank in user_result:
-            rank = user_result["rank"]
-        if max_rank in user_result:
-            max_rank = user_result["maxRank"]
+        rank = user_result.get("rank", "unrated")
+        max_rank = user_result.get("maxRank", "unrated")
         
     # Pick random problem
-    if isinstance(pset_result, int):
-        await ctx.edit_original_response(content=f"Error (PSET): Codeforces responded with a status code of {pset_result}!\nThe API may be down, do not contact Shor for this error unless you are sure it is a problem with the bot.")
-        return
-    elif pset_result["status"] != "OK":
-        await ctx.edit_original_response(content=f"Error (PSET): Codeforces responded with a status string of {pset_result['status']}!\nCheck that your handle is correct, the API may also be down.")
+    await catalog.ensure_loaded()
+    if len(catalog) == 0:
+        await ctx.edit_original_response(content=f"Error (PSET): The problem catalog is empty!\nThe API may be down, do not contact Shor for this error unless you are sure it is a problem with the bot.")
         return
     else:
-        pset_result = pset_result["result"]["problems"]
-        
-        problem_passed_checks = False
-        problem = None
-        problem_url = None
-        while not problem_passed_checks:
-            random_problem_idx = random.randint(0, len(pset_result) - 1)
-            problem = pset_result[random_problem_idx]
-            
-            if "contestId" in problem:
-                problem_url = await get_cf_url(problem["contestId"], problem["index"])
-                problem_passed_checks = True
+        problem = catalog.random_problem()
+        problem_url = await get_cf_url(problem.contestId, problem.index)
         
         embed = disnake.Embed(
             title= f"{cf_handle}",
-            description=f"Max Rank: {max_rank}\nRank: {rank}\n\nIf this is you, please submit a Compile Error to the problem below within 60 seconds. (click the button!)",
+            description=f"Max Rank: {max_rank}\nRank: {rank}\n\nIf this is you, please submit a Compile Error to the problem below within {REGISTER_TIMEOUT} seconds. (click the button!)",
             color=disnake.Colour.yellow(),
             timestamp=datetime.datetime.now(),
         )
@@ -331,45 +388,9 @@ async def register(ctx : disnake.ApplicationCommandInteraction, cf_handle : str)
             disnake.ui.Button(label="Click me!", style=disnake.ButtonStyle.link, url=problem_url)
         ])
         
-        await asyncio.sleep(60)
-        
-        sub_req = ("user.status", {"handle": cf_handle, "count": 10})
-        sub_result = (await make_cf_requests([sub_req]))[0]
-        
-        # Get submissions
-        verified = False
-        
-        if isinstance(sub_result, int):
-            await ctx.edit_original_response(content=f"Error (SUB): Codeforces responded with a status code of {sub_result}!\nThe API may be down, do not contact Shor for this error unless you are sure it is a problem with the bot.")
-            return
-        elif sub_result["status"] != "OK":
-            await ctx.edit_original_response(f"Error (SUB): Codeforces responded with a status string of {sub_result['status']}!\nCheck that your handle is correct, the API may also be down.")
-            return
-        else:
-            sub_result = sub_result["result"]
-            for sub in sub_result:
-                isSameProblem = ((sub["problem"]["contestId"] == problem["contestId"]) and (sub["problem"]["index"] == problem["index"]))
-                
-                if "verdict" in sub and sub["verdict"] == "COMPILATION_ERROR" and isSameProblem:
-                    verified = True
-        
-        if verified:
-            await db_update_handle(auth.id, cf_handle)
-            embed = disnake.Embed(
-                title= f"{cf_handle} verified!",
-                description=f"Handle verified!",
-                color=disnake.Colour.green(),
-                timestamp=datetime.datetime.now(),
-            )
-            await ctx.edit_original_response(embed=embed, components=[])
-        else:
-            embed = disnake.Embed(
-                title= f"Verification failed.",
-                description=f"Did you submit a Compile Error to the problem on the correct account within 60 seconds? If not, please retry.",
-                color=disnake.Colour.red(),
-                timestamp=datetime.datetime.now(),
-            )
-            await ctx.edit_original_response(embed=embed, components=[])
+        # registration_check takes it from here
+        await registrations.begin(auth.id, cf_handle, problem.contestId, problem.index, ctx.channel_id)
+        register_interactions[auth.id] = ctx
     
 @bot.slash_command(description="Sets the challenge channel to the current channel!")
 async def set_challenge_channel(ctx : disnake.ApplicationCommandInteraction):
@@ -377,14 +398,13 @@ async def set_challenge_channel(ctx : disnake.ApplicationCommandInteraction):
     guildID = ctx.guild_id
     channelID = ctx.channel_id
     
-    async with sql.connect(DB) as db:
-        await db.execute("UPDATE OR IGNORE guild_data SET challenge_channel = ? WHERE guild = ?", (channelID, guildID))
-        await db.execute("INSERT OR IGNORE INTO guild_data(challenge_channel, guild) VALUES(?, ?)", (channelID, guildID))
-        await db.commit()
-
-    asyncio.run_coroutine_threadsafe(fetch_challenge_data(), bot.loop)
-    # To maintainer: This code is SLOW if the discord bot runs on multiple servers!
-    # This is only acceptable due to the bot being built for one/two servers.
+    if guildID is None:
+        await ctx.response.send_message("The challenge channel can only be set in a server!")
+        return
+    
+    await guilds.set_channel(guildID, channelID)
+    if guildID not in scheduler:
+        scheduler.schedule(guildID)
     
     await ctx.response.send_message("Challenge channel successfully set!")
     
@@ -393,24 +413,19 @@ async def complete_challenge(ctx : disnake.ApplicationCommandInteraction, rating
     await ctx.response.defer()
     userID = ctx.author.id
     cur_chall_date = None
-        
-    async with sql.connect(DB) as db:
-        async with db.execute('SELECT data FROM app_data WHERE key = "last_challenge_date"') as cursor:
-            fetched = await cursor.fetchone()
-            
-            if fetched is None:
-                print("ERROR: last_challenge_date is not found in app_data table")
-            else:
-                cur_chall_date = datetime.date.fromisoformat(fetched[0])
     
     fetched = None
     fetched_problem = None
-    async with sql.connect(DB) as db:
-        async with db.execute('SELECT codeforcesHandle, lastChallengeDate, score FROM user_data WHERE userID = ?', (userID,)) as cursor:
+    cur_chall_date = scheduler.current_date(ctx.guild_id)
+    async with db.read() as conn:
+        async with conn.execute('SELECT codeforcesHandle, lastChallengeDate, score FROM user_data WHERE userID = ?', (userID,)) as cursor:
             fetched = await cursor.fetchone()
-            
-        async with db.execute('SELECT problemContestID, problemIndex FROM challenge_data WHERE date = ? AND rating = ?', (cur_chall_date.isoformat(), rating)) as cursor:
-            fetched_problem = await cursor.fetchone()
+        
+        if cur_chall_date is not None:
+            # The server's own set if it had one that day, otherwise the shared one
+            async with conn.execute('SELECT problemContestID, problemIndex FROM challenge_data WHERE date = ? AND rating = ? AND guild = COALESCE((SELECT guild FROM challenge_data WHERE date = ? AND guild = ? LIMIT 1), ?)',
+                                    (cur_chall_date.isoformat(), rating, cur_chall_date.isoformat(), ctx.guild_id, DEFAULT_SCOPE)) as cursor:
+                fetched_problem = await cursor.fetchone()
             
     if fetched is None or fetched[0] is None:
         await ctx.edit_original_response(content=f"You have not registered with this bot yet! Do /register.")
@@ -420,6 +435,10 @@ async def complete_challenge(ctx : disnake.ApplicationCommandInteraction, rating
     last_challenge_date = datetime.date.fromisoformat( fetched[1] )
     init_score = fetched[2]
     
+    if cur_chall_date is None:
+        await ctx.edit_original_response(content=f"There is no challenge yet!")
+        return
+    
     if last_challenge_date >= cur_chall_date:
         await ctx.edit_original_response(content=f"You have already completed today ({cur_chall_date.isoformat()})'s challenge! You may only complete one challenge per day.")
         return
@@ -431,91 +450,421 @@ async def complete_challenge(ctx : disnake.ApplicationCommandInteraction, rating
     problemContestID = fetched_problem[0]
     problemIndex = fetched_problem[1]
     
-    sub_req = ("user.status", {"handle": cf_handle, "count": 30})
-    sub_result = (await make_cf_requests([sub_req]))[0]
-    
-    # Get submissions
-    verified = False
+    # Get submissions (shared with other checks of the same handle)
+    sub_result = await verifier.find_submission(cf_handle, problemContestID, problemIndex, "OK")
     
     if isinstance(sub_result, int):
         await ctx.edit_original_response(content=f"Error (SUB): Codeforces responded with a status code of {sub_result}!\nThe API may be down, do not contact Shor for this error unless you are sure it is a problem with the bot.")
         return
-    elif sub_result["status"] != "OK":
+    elif sub_result is not None and "status" in sub_result:
         await ctx.edit_original_response(f"Error (SUB): Codeforces responded with a status string of {sub_result['status']}!\nCheck that your handle is correct, the API may also be down.")
         return
-    else:
-        sub_result = sub_result["result"]
-        for sub in sub_result:
-            isSameProblem = ((sub["problem"]["contestId"] == problemContestID) and (sub["problem"]["index"] == problemIndex))
-            
-            if "verdict" in sub and sub["verdict"] == "OK" and isSameProblem:
-                verified = True
+    
+    verified = sub_result is not None
                 
     if not verified:
-        await ctx.edit_original_response(content=f"No AC submission was detected in your last 30 submissions to the problem {problemContestID}{problemIndex}!\nPlease double check that you have the right problem, and/or resubmit your solution.")
+        await ctx.edit_original_response(content=f"No AC submission was detected in your last {SUBMISSION_WINDOW} submissions to the problem {problemContestID}{problemIndex}!\nPlease double check that you have the right problem, and/or resubmit your solution.")
         return
     
     # Verified
-    score_increase = await get_scoring(rating)
-    async with sql.connect(DB) as db:
-        await db.execute('UPDATE user_data SET score = score + ? WHERE userID = ?', (score_increase, userID,))
-        await db.execute('UPDATE user_data SET lastChallengeDate = ? WHERE userID = ?', (cur_chall_date, userID,))
-        await db.commit()
-        
+    # The date check inside makes a second concurrent call a no-op
+    async with db.transaction() as conn:
+        credited = await credit_challenges(conn, cur_chall_date, {userID: Completion(rating, ctx.guild_id or DEFAULT_SCOPE, sub_result["id"])})
+    
+    if userID not in credited:
+        await ctx.edit_original_response(content=f"You have already completed today ({cur_chall_date.isoformat()})'s challenge! You may only complete one challenge per day.")
+        return
+    
+    score_increase = credited[userID]
+    leaderboard.add_points(credited)
     await ctx.edit_original_response(content=f"Your AC submission has successfully been detected! {score_increase} has been added to your score, making it {init_score + score_increase}.")
 
-# Tasks
-@tasks.loop(time=[CHALLENGE_TIME])
-async def challenge_update():
-    cur_date = datetime.datetime.now(tz=TIMEZONE).date()
-    should_perform_challenge_today = False
-    async with sql.connect(DB) as db:
-        async with db.execute('SELECT data FROM app_data WHERE key = "last_challenge_date"') as cursor:
-            last_challenge_date = datetime.date.fromisoformat( (await cursor.fetchone())[0])
-            # Fetch last challenge date, and converts it to datetime.date object
-            
-            if cur_date > last_challenge_date:
-                should_perform_challenge_today = True
-                
-    print(f"Challenge check - should perform challenge? : {should_perform_challenge_today}")
+@bot.slash_command(name="leaderboard", description="Shows the challenge scoreboard!")
+async def leaderboard_command(
+    ctx : disnake.ApplicationCommandInteraction,
+    page : int = commands.Param(default=1, ge=1),
+    scope : str = commands.Param(default="server", choices=["server", "global"]),
+):
+    # Scores are all in memory, no need to defer
+    if scope == "global" or ctx.guild_id is None:
+        scope_id = GLOBAL
+        title = "Global Leaderboard"
+    else:
+        scope_id = ctx.guild_id
+        title = f"{ctx.guild.name if ctx.guild else 'Server'} Leaderboard"
     
-    if should_perform_challenge_today:
-        
-        challenge_set = await generate_challenge_set()
-        
-        embed = await create_challenge_set_embed(challenge_set)
-        
-        for guild in challenge_guilds:
-            if challenge_channel_id[guild] is None:
-                continue # Ignore this guild
-            
-            
-            # Begin challenge!
-            channelID = challenge_channel_id[guild]
-            channel = await bot.fetch_channel(channelID)
-            
-            
-            await channel.send(embed=embed)
+    page_count = leaderboard.page_count(scope_id)
+    page = min(page, page_count)
+    
+    embed = disnake.Embed(
+        title= title,
+        description=leaderboard.render_page(scope_id, page),
+        color=disnake.Colour.gold(),
+        timestamp=datetime.datetime.now(),
+    )
+    
+    rank = leaderboard.rank(scope_id, ctx.author.id)
+    embed.set_footer(text=f"Page {page}/{page_count}" + (f" - Your rank: #{rank}" if rank is not None else ""))
+    
+    await ctx.response.send_message(embed=embed)
+
+@bot.slash_command(description="Recommends unsolved problems at your level, aimed at your weaker tags!")
+async def recommend(
+    ctx : disnake.ApplicationCommandInteraction,
+    count : int = commands.Param(default=5, ge=1, le=10, description="How many problems"),
+    tag : str = commands.Param(default=None, description="Only problems with this tag, like dp"),
+):
+    await ctx.response.defer()
+    fetched = await db.fetchone('SELECT codeforcesHandle FROM user_data WHERE userID = ?', (ctx.author.id,))
+    if fetched is None or fetched[0] is None:
+        await ctx.edit_original_response(content=f"You have not registered with this bot yet! Do /register.")
+        return
+    cf_handle = fetched[0]
+    
+    await catalog.ensure_loaded()
+    if tag is not None:
+        tag = tag.strip().lower()
+        if tag not in catalog.by_tag:
+            await ctx.edit_original_response(content=f"Unknown tag {tag}, use a Codeforces tag like dp or greedy.")
+            return
+    
+    result = await recommender.recommend(cf_handle, count, tag)
+    if isinstance(result, int):
+        await ctx.edit_original_response(content=f"Error (REC): Codeforces responded with a status code of {result}!\nThe API may be down, do not contact Shor for this error unless you are sure it is a problem with the bot.")
+        return
+    elif isinstance(result, dict):
+        await ctx.edit_original_response(content=f"Error (REC): Codeforces responded with a status string of {result.get('status')}!\nCheck that your handle is correct, the API may also be down.")
+        return
+    
+    if not result.problems:
+        await ctx.edit_original_response(content=f"No unsolved problems were found" + (f" with the tag {tag}" if tag else "") + "!")
+        return
+    
+    lines = []
+    for problem in result.problems:
+        lines.append(f"[{problem.contestId}{problem.index} - {problem.name}]({await get_cf_url(problem.contestId, problem.index)}) ({problem.rating}) - {', '.join(problem.tags) or 'no tags'}")
+    embed = disnake.Embed(
+        title=f"Recommended for {cf_handle}",
+        description="\n".join(lines),
+        color=disnake.Colour.blue(),
+        timestamp=datetime.datetime.now(),
+    )
+    footer = f"Aimed at rating {result.target}"
+    if result.weak_tags:
+        footer += f" - Weakest tags: {', '.join(result.weak_tags)}"
+    embed.set_footer(text=footer)
+    await ctx.edit_original_response(embed=embed)
+
+# Parses /challenge_settings options on top of a guild's current config.
+# Raises ValueError with a message for the user if an option is invalid.
+def parse_challenge_settings(config, ratings, post_time, timezone, tags, min_contest_id):
+    if ratings is not None:
+        try:
+            parsed = tuple(sorted({int(rating) for rating in ratings.replace(" ", "").split(",") if rating}))
+        except ValueError:
+            raise ValueError(f"Ratings should be numbers separated by commas, like 800,1200,1600.")
+        low, high = CHALLENGE_RATING_RANGE
+        if not parsed or any(rating < low or rating > high or rating % 100 != 0 for rating in parsed):
+            raise ValueError(f"Ratings should be multiples of 100 from {low} to {high}.")
+        config = config._replace(ratings=parsed)
+    
+    if post_time is not None:
+        try:
+            config = config._replace(postTime=datetime.time.fromisoformat(post_time.strip()).replace(second=0, microsecond=0, tzinfo=None))
+        except ValueError:
+            raise ValueError(f"The post time should look like 21:00.")
+    
+    if timezone is not None:
+        try:
+            config = config._replace(timezone=ZoneInfo(timezone.strip()))
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone {timezone}, use a name like Asia/Singapore.")
+    
+    if tags is not None:
+        parsed = frozenset(tag.strip() for tag in tags.split(";") if tag.strip() and tag.strip() != "any")
+        unknown = [tag for tag in parsed if tag not in catalog.by_tag]
+        if unknown and len(catalog) > 0:
+            raise ValueError(f"Unknown tags: {', '.join(sorted(unknown))}.")
+        config = config._replace(tags=parsed)
+    
+    if min_contest_id is not None:
+        # The catalog never holds problems from older contests, a lower value would silently change nothing
+        if min_contest_id < catalog.min_contest_id:
+            raise ValueError(f"The minimum contest should be at least {catalog.min_contest_id}, older problems are not in the bot's problem list.")
+        config = config._replace(minContestId=min_contest_id)
+    
+    return config
+
+@bot.slash_command(description="Shows or changes this server's daily challenge settings!", default_member_permissions=disnake.Permissions(manage_guild=True))
+async def challenge_settings(
+    ctx : disnake.ApplicationCommandInteraction,
+    ratings : str = commands.Param(default=None, description="Ratings separated by commas, like 800,1200,1600"),
+    post_time : str = commands.Param(default=None, description="Time of day the challenge is posted, like 21:00"),
+    timezone : str = commands.Param(default=None, description="Timezone of the post time and challenge dates, like Asia/Singapore"),
+    tags : str = commands.Param(default=None, description="Only problems with one of these tags, separated by ; (\"any\" for no filter)"),
+    min_contest_id : int = commands.Param(default=None, ge=MIN_CHALLENGE_CONTEST_ID, description=f"Only problems from contests after this one (at least {MIN_CHALLENGE_CONTEST_ID})"),
+    reset : bool = commands.Param(default=False, description="Go back to the default settings"),
+):
+    guildID = ctx.guild_id
+    
+    if guildID is None:
+        await ctx.response.send_message("Challenge settings can only be changed in a server!")
+        return
+    
+    if reset:
+        await settings.remove(guildID)
+    elif any(option is not None for option in (ratings, post_time, timezone, tags, min_contest_id)):
+        try:
+            config = parse_challenge_settings(settings.get(guildID), ratings, post_time, timezone, tags, min_contest_id)
+        except ValueError as e:
+            await ctx.response.send_message(f"Invalid settings: {e}")
+            return
+        await settings.set(guildID, config)
+    
+    if guildID in scheduler:
+        scheduler.schedule(guildID) # The post time or timezone may have changed
+    
+    config = settings.get(guildID)
+    description = f"Ratings: {', '.join(str(rating) for rating in config.ratings)}\n"
+    description += f"Post time: {config.postTime.strftime('%H:%M')} ({config.timezone.key})\n"
+    description += f"Tags: {'; '.join(sorted(config.tags)) if config.tags else 'any'}\n"
+    description += f"Problems from contests after: {max(config.minContestId, catalog.min_contest_id)}\n"
+    
+    embed = disnake.Embed(
+        title= f"{ctx.guild.name if ctx.guild else 'Server'} Challenge Settings" + ("" if guildID in settings else " (default)"),
+        description=description.strip(),
+        color=disnake.Colour.blurple(),
+        timestamp=datetime.datetime.now(),
+    )
+    embed.set_footer(text="Changes apply from the next challenge.")
+    
+    await ctx.response.send_message(embed=embed)
+
+# Tasks
+@tasks.loop(hours=PROBLEMSET_REFRESH_HOURS)
+async def problemset_refresh():
+    await catalog.ensure_loaded()
+    # With several processes, one downloads and the others pick the new catalog up from the database
+    if await leases.acquire("problemset_refresh", PROBLEMSET_REFRESH_HOURS * 3600 * 1.5):
+        await catalog.refresh()
+    else:
+        await catalog.sync()
+
+# Sleeps until the next guild is due, then posts every guild due by then
+@tasks.loop()
+async def challenge_schedule():
+    await scheduler.run_due(post_challenges)
+    await scheduler.wait()
+
+# Posts the challenge of every due (guild, date), called by the scheduler
+# A scope's set is generated the first time one of its guilds is due on a date, the others reuse it
+async def post_challenges(due):
+    by_date = {}
+    for guild, date in due:
+        by_date.setdefault(date, []).append(guild)
+    
+    # Loaded before the transaction: a refresh makes a request and writes the catalog itself
+    await catalog.ensure_loaded()
+    if len(catalog) == 0:
+        raise RuntimeError("the problem catalog is empty, Codeforces may be down") # The scheduler retries
+    for date, due_guilds in sorted(by_date.items()):
+        channels = [(guild, guilds.get_channel(guild)) for guild in due_guilds if guilds.get_channel(guild) is not None]
         
-        async with sql.connect(DB) as db:
-            await db.execute('UPDATE app_data SET data = ? WHERE key = "last_challenge_date"', (cur_date,))
+        # The new sets and every guild's delivery are saved before anything is sent.
+        # The write transaction locks the database for other bot processes too, so a set another
+        # process is generating is seen here and reused, never generated twice.
+        async with db.transaction() as conn:
+            challenge_sets = await db_get_challenge_sets(date, conn)
+            for scope, challenge_set in challenge_sets.items():
+                selector.mark_issued(scope, challenge_set)
+            new_sets = await generate_challenge_sets({settings.scope(guild) for guild in due_guilds} - set(challenge_sets))
             
-            for rating in CHALLENGE_RATINGS:
-                problem = challenge_set[rating] 
-                await db.execute("INSERT INTO challenge_data(date, rating, problemContestID, problemIndex) VALUES(?, ?, ?, ?)", (cur_date, rating, problem["contestId"], problem["index"]))
-            
-            await db.commit()  
+            await conn.executemany("INSERT OR IGNORE INTO challenge_data(date, guild, rating, problemContestID, problemIndex) VALUES(?, ?, ?, ?, ?)",
+                                   [(date.isoformat(), scope, rating, problem.contestId, problem.index) for scope, challenge_set in new_sets.items() for rating, problem in challenge_set.items()])
             
+            await broadcaster.queue(conn, date, channels)
+        scheduler.posted(due_guilds, date)
         
-            
-                
+        log.info(f"Challenge for {date.isoformat()}: {len(channels)} guilds due, {len(new_sets)} new sets")
+        if channels:
+            challenge_sets.update(new_sets)
+            await send_challenge_sets(date, challenge_sets, [guild for guild, channel in channels])
 
+# Sends the challenge sets of a date to pending guilds, each guild gets its own set or the shared one
+async def send_challenge_sets(date, challenge_sets, due_guilds = None):
+    embeds = {scope: await create_challenge_set_embed(challenge_set, date) for scope, challenge_set in challenge_sets.items()}
+    await broadcaster.run(date, lambda guild: embeds.get(guild, embeds.get(DEFAULT_SCOPE)), due_guilds)
+
+# Sends the current challenges that some of this process' guilds haven't received yet, older ones are expired instead
+async def resume_challenge_broadcast():
+    current = scheduler.current_dates()
+    if not current:
+        return
+    await broadcaster.expire_before(min(current))
+    own_guilds = [guild for guild, channel in guilds.challenge_channels() if SHARDS.owns(guild)]
+    for date in sorted(current):
+        if await broadcaster.has_pending(date):
+            await send_challenge_sets(date, await db_get_challenge_sets(date), own_guilds)
+
+# Retries the current challenges' deliveries that failed, the first run is right after the resume on startup so it's skipped
+@tasks.loop(seconds=BROADCAST_RETRY_INTERVAL)
+async def broadcast_retry():
+    if broadcast_retry.current_loop == 0:
+        return
+    own_guilds = [guild for guild, channel in guilds.challenge_channels() if SHARDS.owns(guild)]
+    for date in sorted(scheduler.current_dates()):
+        if await broadcaster.has_pending(date):
+            await send_challenge_sets(date, await db_get_challenge_sets(date), own_guilds)
+
+# Finishes pending registrations, all handles checked together
+@tasks.loop(seconds=REGISTER_POLL_INTERVAL)
+async def registration_check():
+    verified, expired = await registrations.check()
+    
+    for pending in verified:
+        leaderboard.add_user(pending.userID)
+    
+    await asyncio.gather(*(report_registration(pending, True) for pending in verified),
+                         *(report_registration(pending, False) for pending in expired))
+
+# Tells a user how their registration went
+# Edits the /register response if possible, otherwise (e.g. after a restart) posts in the channel it was used in
+async def report_registration(pending, verified):
+    if verified:
+        embed = disnake.Embed(
+            title= f"{pending.handle} verified!",
+            description=f"Handle verified!",
+            color=disnake.Colour.green(),
+            timestamp=datetime.datetime.now(),
+        )
+    else:
+        embed = disnake.Embed(
+            title= f"Verification failed.",
+            description=f"Did you submit a Compile Error to the problem on the correct account within {REGISTER_TIMEOUT} seconds? If not, please retry.",
+            color=disnake.Colour.red(),
+            timestamp=datetime.datetime.now(),
+        )
+    
+    ctx = register_interactions.pop(pending.userID, None)
+    try:
+        if ctx is not None:
+            await ctx.edit_original_response(embed=embed, components=[])
+        elif pending.channelID is not None:
+            channel = bot.get_channel(pending.channelID) or await bot.fetch_channel(pending.channelID)
+            await channel.send(content=f"<@{pending.userID}>", embed=embed)
+    except disnake.HTTPException as e:
+        log.error(f"Error (REGISTER): could not report verification of {pending.handle}: {e!r}")
+
+# Credits solves of the latest challenges by polling their contests
+# Guilds in different timezones can be on different dates
+@tasks.loop(seconds=AUTO_CREDIT_INTERVAL)
+async def auto_credit():
+    # One process polls for every guild
+    if not await leases.acquire("auto_credit", AUTO_CREDIT_INTERVAL * 3):
+        return
+    if SHARDS.partial:
+        await scheduler.load(db) # Picks up the dates other processes posted
+    
+    for challenge_date in sorted(scheduler.current_dates()):
+        # Only solves after the challenge was posted count
+        since = scheduler.first_slot(challenge_date)
         
-        
-            
+        challenge_sets = await db_get_challenge_sets(challenge_date)
+        credited = await poller.poll(challenge_date, challenge_sets, since)
+        leaderboard.add_points(credited)
+
+# Picks up points awarded by other processes
+@tasks.loop(seconds=LEADERBOARD_SYNC_INTERVAL)
+async def leaderboard_sync():
+    await leaderboard.load()
+
+# Startup, in this order
+@lifecycle.on_startup("database")
+async def open_database():
+    await db.open(schema=[PROBLEMSET_SCHEMA, PROBLEM_STATS_SCHEMA, CHALLENGES_SCHEMA, SETTINGS_SCHEMA, LEASES_SCHEMA, BROADCAST_SCHEMA, *POLLER_SCHEMA, REGISTRATION_SCHEMA, *LEADERBOARD_SCHEMA, *LEDGER_SCHEMA])
+    async with db.transaction() as conn:
+        await migrate_challenges(conn)
+        await migrate_ledger(conn)
+
+# Small tables kept in memory, and the challenge schedule built from them
+@lifecycle.on_startup("state")
+async def load_state():
+    await guilds.load()
+    await settings.load()
+    await selector.load(db)
+    await scheduler.load(db)
+    # The shared set is generated at the default time even if no guild uses it, for /complete_challenge outside of servers
+    # Each process only posts to the guilds of its own shards
+    for guild in [DEFAULT_SCOPE, *(guild for guild, channel in guilds.challenge_channels() if SHARDS.owns(guild))]:
+        scheduler.schedule(guild)
+    await registrations.load()
+    await leaderboard.load()
+
+# The catalog and profiles are loaded from their snapshots in the background, so the bot connects right away.
+# Anything needing the catalog before then waits in catalog.ensure_loaded().
+@lifecycle.on_startup("caches")
+async def warm_caches():
+    global cache_warmup
+    catalog.snapshot_path = os.path.join(SNAPSHOT_DIR, "catalog.json")
+    cache_warmup = asyncio.create_task(load_caches())
+
+async def load_caches():
+    cached = await profiles.load_snapshot(os.path.join(SNAPSHOT_DIR, "profiles.json"))
+    log.info(f"Profile cache loaded! ({cached} profiles)")
+    await catalog.ensure_loaded()
+
+# Shutdown, in this order
+# Loops finish the iteration they are in (a fan-out or registration check), so what they were doing is saved
+# as done or still pending (challenge_broadcast and pending_verification rows) and picked up after the restart.
+@lifecycle.on_shutdown("tasks")
+async def stop_tasks():
+    if cache_warmup is not None:
+        cache_warmup.cancel()
+    loops = [challenge_schedule, broadcast_retry, registration_check, auto_credit, leaderboard_sync, problemset_refresh]
+    for loop in loops:
+        if loop.is_running():
+            loop.stop()
+    deadline = asyncio.get_running_loop().time() + SHUTDOWN_TIMEOUT - 1
+    while any(loop.is_running() for loop in loops) and asyncio.get_running_loop().time() < deadline:
+        scheduler.wake() # Otherwise the schedule loop sleeps until the next post
+        await asyncio.sleep(0.05)
+    for loop in loops:
+        if loop.is_running():
+            log.warning(f"Warning (SHUTDOWN): {loop.coro.__name__} did not stop in time, cancelled")
+            loop.cancel()
+
+@lifecycle.on_shutdown("discord")
+async def close_discord():
+    await bot.close()
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+
+# Lets another process take the jobs over right away instead of after the lease expires
+@lifecycle.on_shutdown("leases")
+async def release_leases():
+    for name in ("problemset_refresh", "auto_credit"):
+        await leases.release(name)
+
+@lifecycle.on_shutdown("codeforces")
+async def drain_codeforces():
+    if not await cf_client.drain(CF_DRAIN_TIMEOUT):
+        log.warning(f"Warning (SHUTDOWN): {cf_client.queue_depth()} Codeforces requests were still queued, dropped")
+    await cf_client.close()
+
+@lifecycle.on_shutdown("snapshots")
+async def save_snapshots():
+    await catalog.save_snapshot(os.path.join(SNAPSHOT_DIR, "catalog.json"))
+    await profiles.save_snapshot(os.path.join(SNAPSHOT_DIR, "profiles.json"))
+
+@lifecycle.on_shutdown("database")
+async def close_database():
+    await db.close()
 
 # Main Function
-token = grab_token()
-print("Bot token retrieval successful.")
-asyncio.run(fetch_challenge_data())
-bot.run(token)
+if __name__ == "__main__":
+    setup_logging(LOG_FILE, LOG_MAX_BYTES, LOG_BACKUPS)
+    token = grab_token()
+    log.info("Bot token retrieval successful.")
+    # Everything runs on the bot's own loop, the pooled connections are tied to it.
+    # SIGINT/SIGTERM shut down in order (see the hooks above) instead of killing the process.
+    bot.loop.run_until_complete(lifecycle.run(lambda: bot.start(token)))
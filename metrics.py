@@ -0,0 +1,181 @@
+# Metrics and tracing
+# Counters, gauges and histograms kept in memory and served in Prometheus' text format on a local
+# HTTP endpoint (/metrics). Updating one is a dict lookup and an addition, so it's cheap enough for
+# every command, Codeforces request and database statement.
+# Each slash command also gets a trace: Codeforces waits and database statements made while it runs
+# are recorded as spans, and commands slower than a threshold are logged and kept for /traces.
+
+import bisect
+import collections
+import contextvars
+import logging
+import time
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = [] # Every metric, in definition order
+
+def _escape(value : str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name : str, help : str, labels : tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {} # Tuple of label values to the metric's value
+        REGISTRY.append(self)
+
+    def _key(self, labels) -> tuple[str, ...]:
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {labels}")
+        return tuple(str(label) for label in labels)
+
+    def _format_labels(self, key, extra : str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in self.values.items()]
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()])
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount : float = 1):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name : str, help : str, labels : tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._function = None
+
+    def set(self, value : float, *labels):
+        self.values[self._key(labels)] = value
+
+    # Reads the value when scraped instead (unlabelled gauges only)
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self) -> list[str]:
+        if self._function is not None:
+            return [f"{self.name} {self._function()}"]
+        return super()._samples()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name : str, help : str, labels : tuple[str, ...] = (), buckets : tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value : float, *labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0] # Per-bucket counts (last is +Inf), sum, count
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _samples(self) -> list[str]:
+        samples = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                labels = self._format_labels(key, f'le="{bound}"')
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            samples.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            samples.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return samples
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+# Tracing
+
+class Trace:
+    __slots__ = ("name", "start", "spans")
+
+    def __init__(self, name : str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = [] # (name, milliseconds)
+
+class Tracer:
+    def __init__(self, slow_threshold : float = 2.0, keep : int = 50, max_spans : int = 100):
+        self.slow_threshold = slow_threshold # Seconds, slower traces are logged and kept
+        self.max_spans = max_spans # Spans kept per trace
+        self.slow = collections.deque(maxlen=keep) # Latest slow traces, as dicts
+        self._current = contextvars.ContextVar("trace", default=None)
+
+    # Starts a trace for the current task (spans of tasks it creates land in it too)
+    def start(self, name : str) -> Trace:
+        trace = Trace(name)
+        self._current.set(trace)
+        return trace
+
+    def current(self) -> Trace | None:
+        return self._current.get()
+
+    def span(self, name : str, seconds : float):
+        trace = self._current.get()
+        if trace is not None and len(trace.spans) < self.max_spans:
+            trace.spans.append((name, round(seconds * 1000, 2)))
+
+    # Ends a trace, returns its duration in seconds
+    def finish(self, trace : Trace, status : str) -> float:
+        duration = time.perf_counter() - trace.start
+        if self._current.get() is trace:
+            self._current.set(None)
+        if duration >= self.slow_threshold:
+            record = {"name": trace.name, "status": status, "ms": round(duration * 1000, 2), "at": time.time(), "spans": trace.spans}
+            self.slow.append(record)
+            log.warning("Slow %s (%s) took %.0f ms: %s", trace.name, status, duration * 1000, trace.spans)
+        return duration
+
+tracer = Tracer()
+
+# HTTP endpoint
+
+async def _metrics(request : web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def _traces(request : web.Request) -> web.Response:
+    return web.json_response(list(tracer.slow))
+
+# Serves /metrics and /traces, returns the runner (cleanup() stops it)
+async def start_server(host : str = "127.0.0.1", port : int = 9108) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    app.router.add_get("/traces", _traces)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("Metrics served on http://%s:%s/metrics", host, port)
+    return runner
+
+# The bot's metrics
+
+COMMAND_SECONDS = Histogram("bot_command_duration_seconds", "Slash command latency, from invoke to completion.", ("command", "status"))
+CF_REQUESTS = Counter("cf_requests_total", "Codeforces API responses by method and HTTP status (or error).", ("method", "status"))
+CF_REQUEST_SECONDS = Histogram("cf_request_duration_seconds", "Codeforces API round trip, without queueing.", ("method",))
+CF_WAIT_SECONDS = Histogram("cf_request_wait_seconds", "Time callers wait for a Codeforces response, queueing and retries included.", ("method", "priority"))
+CF_QUEUE_DEPTH = Gauge("cf_queue_depth", "Codeforces requests waiting for the rate limiter.")
+DB_STATEMENT_SECONDS = Histogram("db_statement_duration_seconds", "Database statement execution time.", ("statement",))
+BROADCAST_SECONDS = Histogram("challenge_fanout_duration_seconds", "Time to send one challenge to every due guild.", buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+BROADCAST_DELIVERIES = Counter("challenge_deliveries_total", "Challenge posts by outcome.", ("status",))
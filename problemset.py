@@ -0,0 +1,368 @@
+# Problem catalog
+# Local copy of Codeforces' problemset. It is saved in the database so a restart doesn't need
+# the API, refreshed on a schedule, and indexed in memory so picking problems costs no request.
+
+import asyncio
+import codecs
+import datetime
+import hashlib
+import json
+import logging
+import random
+import re
+import sys
+import typing
+
+from cf_api import CodeforcesClient, PRIORITY_BACKGROUND
+from database import Database
+import snapshots
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS `problemset` (
+    `contestId` INTEGER,
+    `problemIndex` TEXT,
+    `name` TEXT,
+    `rating` INTEGER,
+    `tags` TEXT,
+    PRIMARY KEY(`contestId`, `problemIndex`)
+)
+"""
+
+# How many users solved each problem, refreshed along with the catalog. Kept out of the catalog's hash,
+# the counts change every day but the problems don't.
+STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS `problem_stats` (
+    `contestId` INTEGER,
+    `problemIndex` TEXT,
+    `solvedCount` INTEGER,
+    PRIMARY KEY(`contestId`, `problemIndex`)
+)
+"""
+
+# Keys in app_data used to remember the last refresh
+KEY_REFRESHED_AT = "problemset_refreshed_at"
+KEY_ETAG = "problemset_etag"
+KEY_LAST_MODIFIED = "problemset_last_modified"
+KEY_HASH = "problemset_hash"
+
+TAG_SEPARATOR = ";"
+
+CHUNK_SIZE = 64 * 1024 # Bytes read from the response at a time
+MAX_ITEM_SIZE = 1024 * 1024 # One array element bigger than this means the payload is broken
+WHITESPACE = " \t\r\n"
+
+class Problem(typing.NamedTuple):
+    contestId : int
+    index : str
+    name : str
+    rating : int | None
+    tags : tuple[str, ...]
+
+# Reads the elements of JSON arrays out of a streamed response body, one at a time.
+# Only the current chunk and the element being decoded are ever held in memory.
+class JSONArrayStream:
+    def __init__(self, content):
+        self.content = content # aiohttp StreamReader
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.decode = json.JSONDecoder().raw_decode
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.head = "" # Everything before the first array, to report non-OK payloads
+
+    # Reads one more chunk into the buffer, returns False at the end of the body
+    async def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = await self.content.read(CHUNK_SIZE)
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk, final=not chunk)
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+        return bool(chunk)
+
+    # Moves to just after `"key": [`. Returns False if the body has no such array.
+    async def seek_array(self, key : str) -> bool:
+        pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        while True:
+            match = pattern.search(self.buffer, self.pos)
+            if match is not None:
+                self.pos = match.end()
+                return True
+            keep = max(self.pos, len(self.buffer) - len(key) - 16) # Keep a tail, the key may be split across chunks
+            if len(self.head) < 4096:
+                self.head += self.buffer[self.pos:keep]
+            self.pos = keep
+            if not await self._fill():
+                return False
+
+    # Yields every element of the array seek_array() moved to
+    async def items(self):
+        while True:
+            while self.pos < len(self.buffer) and (self.buffer[self.pos] in WHITESPACE or self.buffer[self.pos] == ","):
+                self.pos += 1
+            if self.pos >= len(self.buffer):
+                if not await self._fill():
+                    raise ValueError("Unexpected end of JSON array")
+                continue
+            if self.buffer[self.pos] == "]":
+                self.pos += 1
+                return
+
+            try:
+                item, end = self.decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Element cut off at the end of the chunk
+                if len(self.buffer) - self.pos > MAX_ITEM_SIZE or not await self._fill():
+                    raise
+                continue
+
+            self.pos = end
+            yield item
+
+class ProblemCatalog:
+    def __init__(self, db : Database, client : CodeforcesClient, max_age : datetime.timedelta = datetime.timedelta(hours=12), min_contest_id : int = 0):
+        self.db = db
+        self.client = client
+        self.max_age = max_age # Refreshes younger than this are skipped
+        self.min_contest_id = min_contest_id # Problems from this contest or older are dropped while parsing
+
+        self.problems = [] # List of every Problem
+        self.by_id = {} # (contestId, index) to Problem
+        self.by_rating = {} # Rating to list of Problems
+        self.by_contest = {} # contestId to list of Problems
+        self.by_tag = {} # Tag to list of Problems
+        self.by_rating_tag = {} # (rating, tag) to list of Problems
+        self.version = 0 # Bumped every time the indexes are rebuilt
+        self.digest = None # Hash of the loaded catalog, to notice another process saving a new one
+        self._candidates = {} # (rating, min contestId) to list of Problems, filled on demand
+        self.solved_counts = {} # (contestId, index) to the number of users who solved it
+        self.stats_version = 0 # Bumped every time solved_counts changes
+        self.snapshot_path = None # Loaded instead of the database if it's of the same catalog
+        self._loading = None # First load, shared by everything waiting for it
+
+    def __len__(self):
+        return len(self.problems)
+
+    def _build_indexes(self, problems : list[Problem]):
+        by_id = {}
+        by_rating = {}
+        by_contest = {}
+        by_tag = {}
+        by_rating_tag = {}
+        for problem in problems:
+            by_id[(problem.contestId, problem.index)] = problem
+            by_contest.setdefault(problem.contestId, []).append(problem)
+            if problem.rating is not None:
+                by_rating.setdefault(problem.rating, []).append(problem)
+            for tag in problem.tags:
+                by_tag.setdefault(tag, []).append(problem)
+                if problem.rating is not None:
+                    by_rating_tag.setdefault((problem.rating, tag), []).append(problem)
+
+        # Swap everything at once so readers never see half-built indexes
+        self.problems = problems
+        self.by_id = by_id
+        self.by_rating = by_rating
+        self.by_contest = by_contest
+        self.by_tag = by_tag
+        self.by_rating_tag = by_rating_tag
+        self.version += 1
+        self._candidates = {}
+
+    # Loads the saved catalog from the database
+    async def load(self):
+        async with self.db.read() as conn:
+            async with conn.execute("SELECT contestId, problemIndex, name, rating, tags FROM problemset") as cursor:
+                rows = await cursor.fetchall()
+            async with conn.execute("SELECT data FROM app_data WHERE key = ?", (KEY_HASH,)) as cursor:
+                digest = await cursor.fetchone()
+            async with conn.execute("SELECT contestId, problemIndex, solvedCount FROM problem_stats") as cursor:
+                stats = await cursor.fetchall()
+
+        self.digest = digest[0] if digest is not None else None
+        self._set_solved_counts({(row[0], row[1]): row[2] for row in stats})
+        self._build_indexes([Problem(row[0], row[1], row[2], row[3], tuple(row[4].split(TAG_SEPARATOR)) if row[4] else ()) for row in rows])
+        log.info(f"Problem catalog loaded! ({len(self.problems)} problems)")
+
+    # Downloads the problemset if the saved copy is older than max_age (or if forced).
+    # Returns True if the catalog changed.
+    async def refresh(self, force : bool = False) -> bool:
+        meta = dict(await self.db.fetchall("SELECT key, data FROM app_data WHERE key IN (?, ?, ?, ?)", (KEY_REFRESHED_AT, KEY_ETAG, KEY_LAST_MODIFIED, KEY_HASH)))
+
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        if not force and self.problems and KEY_REFRESHED_AT in meta:
+            if now - datetime.datetime.fromisoformat(meta[KEY_REFRESHED_AT]) < self.max_age:
+                return False
+
+        # Conditional fetch, in case the API ever sends validators back
+        headers = {}
+        if self.problems and meta.get(KEY_ETAG):
+            headers["If-None-Match"] = meta[KEY_ETAG]
+        if self.problems and meta.get(KEY_LAST_MODIFIED):
+            headers["If-Modified-Since"] = meta[KEY_LAST_MODIFIED]
+
+        pset_result, resp_headers = await self.client.request_conditional("problemset.problems", {}, headers, PRIORITY_BACKGROUND, self._parse_problemset)
+
+        if pset_result == 304:
+            await self._save_meta({KEY_REFRESHED_AT: now.isoformat()})
+            return False
+        elif isinstance(pset_result, int):
+            log.error(f"Error (CATALOG): Codeforces responded with a status code of {pset_result}!")
+            return False
+        elif pset_result["status"] != "OK":
+            log.error(f"Error (CATALOG): Codeforces responded with a status string of {pset_result['status']}!")
+            return False
+
+        problems = pset_result["problems"]
+        digest = pset_result["digest"]
+        solved_counts = pset_result["solved"]
+
+        meta_update = {
+            KEY_REFRESHED_AT: now.isoformat(),
+            KEY_ETAG: resp_headers.get("ETag"),
+            KEY_LAST_MODIFIED: resp_headers.get("Last-Modified"),
+            KEY_HASH: digest,
+        }
+        unchanged = digest == meta.get(KEY_HASH) and self.problems
+        async with self.db.transaction() as conn:
+            if not unchanged:
+                await conn.execute("DELETE FROM problemset")
+                await conn.executemany("INSERT INTO problemset(contestId, problemIndex, name, rating, tags) VALUES(?, ?, ?, ?, ?)",
+                                       ((p.contestId, p.index, p.name, p.rating, TAG_SEPARATOR.join(p.tags)) for p in problems))
+            await conn.execute("DELETE FROM problem_stats")
+            await conn.executemany("INSERT INTO problem_stats(contestId, problemIndex, solvedCount) VALUES(?, ?, ?)",
+                                   ((contestId, index, count) for (contestId, index), count in solved_counts.items()))
+            await conn.executemany("INSERT OR REPLACE INTO app_data(key, data) VALUES(?, ?)", meta_update.items())
+
+        self._set_solved_counts(solved_counts)
+        if unchanged:
+            return False # Identical problems, only the counts and timestamp needed saving
+
+        self._build_indexes(problems)
+        self.digest = digest
+        log.info(f"Problem catalog refreshed! ({len(self.problems)} problems)")
+        return True
+
+    # Reloads the catalog if another process saved a different one. Returns True if it changed.
+    async def sync(self) -> bool:
+        row = await self.db.fetchone("SELECT data FROM app_data WHERE key = ?", (KEY_HASH,))
+        if row is None or row[0] == self.digest:
+            return False
+        await self.load()
+        return True
+
+    # Streams a problemset.problems response, keeping only the Problem fields of the problems that pass
+    # the filters. Returns {"status": "OK", "problems": [...], "digest": ...}, or the parsed payload if
+    # it isn't a problem list (e.g. {"status": "FAILED", ...}).
+    async def _parse_problemset(self, resp) -> dict:
+        stream = JSONArrayStream(resp.content)
+        if not await stream.seek_array("problems"):
+            return json.loads(stream.head + stream.buffer[stream.pos:])
+
+        problems = []
+        kept = set()
+        digest = hashlib.sha256()
+        tag_tuples = {} # Problems share their tags tuples (and strings)
+        async for problem in stream.items():
+            contestId = problem.get("contestId")
+            if not isinstance(contestId, int):
+                continue # Reject due to no (normal) contestID
+            if contestId <= self.min_contest_id:
+                continue # Reject due to too low contestID (recency check)
+
+            tags = tuple(sys.intern(tag) for tag in problem.get("tags", ()))
+            tags = tag_tuples.setdefault(tags, tags)
+            problem = Problem(contestId, sys.intern(problem["index"]), problem["name"], problem.get("rating"), tags)
+            problems.append(problem)
+            kept.add((problem.contestId, problem.index))
+            digest.update(f"{problem.contestId}|{problem.index}|{problem.name}|{problem.rating}|{TAG_SEPARATOR.join(tags)}\n".encode())
+
+        # problemStatistics follows, one {contestId, index, solvedCount} per problem
+        solved = {}
+        if await stream.seek_array("problemStatistics"):
+            async for stat in stream.items():
+                key = (stat.get("contestId"), stat.get("index"))
+                if key in kept:
+                    solved[key] = stat.get("solvedCount", 0)
+
+        return {"status": "OK", "problems": problems, "digest": digest.hexdigest(), "solved": solved}
+
+    def _set_solved_counts(self, solved_counts : dict):
+        self.solved_counts = solved_counts
+        self.stats_version += 1
+
+    async def _save_meta(self, meta : dict):
+        await self.db.executemany("INSERT OR REPLACE INTO app_data(key, data) VALUES(?, ?)", meta.items())
+
+    # Writes the catalog to a snapshot file
+    async def save_snapshot(self, path : str):
+        if not self.problems:
+            return
+        await snapshots.write(path, {"digest": self.digest, "problems": [list(problem) for problem in self.problems],
+                                     "solved": [[contestId, index, count] for (contestId, index), count in self.solved_counts.items()]})
+
+    # Loads a snapshot file, if it holds the same catalog as the database. Returns True if it was loaded.
+    async def load_snapshot(self, path : str) -> bool:
+        snapshot = await snapshots.read(path)
+        if snapshot is None:
+            return False
+        row = await self.db.fetchone("SELECT data FROM app_data WHERE key = ?", (KEY_HASH,))
+        if row is None or row[0] != snapshot.get("digest"):
+            return False # Refreshed since, or never saved
+
+        tag_tuples = {}
+        problems = []
+        for contestId, index, name, rating, tags in snapshot["problems"]:
+            tags = tuple(sys.intern(tag) for tag in tags)
+            problems.append(Problem(contestId, sys.intern(index), name, rating, tag_tuples.setdefault(tags, tags)))
+        self.digest = row[0]
+        self._set_solved_counts({(contestId, index): count for contestId, index, count in snapshot.get("solved", ())})
+        self._build_indexes(problems)
+        log.info(f"Problem catalog loaded from snapshot! ({len(self.problems)} problems)")
+        return True
+
+    # Loads from the snapshot or the database, and only goes to the API if nothing was saved yet.
+    # Concurrent callers share one load.
+    async def ensure_loaded(self):
+        if self.problems:
+            return
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.create_task(self._first_load())
+        await asyncio.shield(self._loading)
+
+    async def _first_load(self):
+        if self.snapshot_path is None or not await self.load_snapshot(self.snapshot_path):
+            await self.load()
+        if not self.problems:
+            await self.refresh(force=True)
+
+    def get(self, contestId : int, index : str) -> Problem | None:
+        return self.by_id.get((contestId, index))
+
+    # Rated problems of a rating from contests after min_contest_id
+    def candidates(self, rating : int, min_contest_id : int = 0) -> list[Problem]:
+        key = (rating, min_contest_id)
+        if key not in self._candidates:
+            self._candidates[key] = [p for p in self.by_rating.get(rating, []) if p.contestId > min_contest_id]
+        return self._candidates[key]
+
+    # Same, limited to problems with at least one of the tags (any problem if there are none)
+    def tagged_candidates(self, rating : int, tags : typing.Iterable[str], min_contest_id : int = 0) -> list[Problem]:
+        tags = sorted(tags)
+        if not tags:
+            return self.candidates(rating, min_contest_id)
+        key = (rating, min_contest_id, *tags)
+        if key not in self._candidates:
+            found = {} # Dict keeps one copy of problems with several of the tags, in order
+            for tag in tags:
+                for p in self.by_rating_tag.get((rating, tag), []):
+                    if p.contestId > min_contest_id:
+                        found[(p.contestId, p.index)] = p
+            self._candidates[key] = list(found.values())
+        return self._candidates[key]
+
+    def random_problem(self) -> Problem:
+        return random.choice(self.problems)
@@ -0,0 +1,123 @@
+# Codeforces profile cache
+# user.info results (rank, rating, avatar...) cached per handle with a TTL and LRU eviction.
+# Lookups that miss are collected for a short window and sent as one user.info request with
+# semicolon-separated handles, so API calls grow with distinct handles, not with commands.
+
+import asyncio
+import collections
+import time
+
+from cf_api import CodeforcesClient, PRIORITY_BACKGROUND
+import snapshots
+
+class ProfileCache:
+    def __init__(self, client : CodeforcesClient, ttl : float = 600, max_size : int = 5000, batch_window : float = 0.05, max_batch : int = 100):
+        self.client = client
+        self.ttl = ttl # Seconds a profile is reused for
+        self.max_size = max_size # Profiles kept, least recently used are dropped first
+        self.batch_window = batch_window # Seconds to wait for more lookups before sending a batch
+        self.max_batch = max_batch # Handles per user.info request
+
+        self._cache = collections.OrderedDict() # Lowercased handle to (expiry, profile)
+        self._waiting = {} # Lowercased handle to (handle, Future) not sent yet
+        self._priority = PRIORITY_BACKGROUND # Most urgent priority among the waiting lookups
+        self._flush_task = None
+
+    def __len__(self):
+        return len(self._cache)
+
+    # Cached profile of a handle, or None
+    def peek(self, handle : str) -> dict | None:
+        key = handle.lower()
+        cached = self._cache.get(key)
+        if cached is None or cached[0] < time.monotonic():
+            return None
+        self._cache.move_to_end(key)
+        return cached[1]
+
+    # Caches a profile, also under the handle it was looked up with (if it was renamed)
+    def put(self, profile : dict, handle : str | None = None):
+        expiry = time.monotonic() + self.ttl
+        for key in {profile["handle"].lower(), (handle or profile["handle"]).lower()}:
+            self._cache[key] = (expiry, profile)
+            self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    # Writes the unexpired profiles to a snapshot file, expiries as unix times
+    async def save_snapshot(self, path : str):
+        now = time.monotonic()
+        offset = time.time() - now
+        entries = [[key, expiry + offset, profile] for key, (expiry, profile) in self._cache.items() if expiry > now]
+        await snapshots.write(path, entries)
+
+    # Loads the profiles of a snapshot file that haven't expired yet. Returns the number of cached profiles.
+    async def load_snapshot(self, path : str) -> int:
+        entries = await snapshots.read(path)
+        if entries is None:
+            return 0
+        now = time.time()
+        offset = now - time.monotonic()
+        for key, expiry, profile in entries:
+            if expiry > now and key not in self._cache: # Profiles fetched since the start are newer
+                self._cache[key] = (expiry - offset, profile)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return len(self._cache)
+
+    # Returns the profile (the User object) of a handle.
+    # If the request fails, the failed response is returned instead (status code, or the parsed json).
+    async def get(self, handle : str, priority : int = PRIORITY_BACKGROUND) -> dict | int:
+        profile = self.peek(handle)
+        if profile is not None:
+            return profile
+
+        key = handle.lower()
+        waiting = self._waiting.get(key)
+        if waiting is None:
+            waiting = self._waiting[key] = (handle, asyncio.get_running_loop().create_future())
+        self._priority = min(self._priority, priority)
+
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+        return await asyncio.shield(waiting[1])
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_window)
+
+        waiting = self._waiting
+        priority = self._priority
+        self._waiting = {}
+        self._priority = PRIORITY_BACKGROUND
+        self._flush_task = None
+
+        items = list(waiting.values())
+        batches = [items[i:i + self.max_batch] for i in range(0, len(items), self.max_batch)]
+        await asyncio.gather(*(self._fetch(batch, priority) for batch in batches))
+
+    async def _fetch(self, batch, priority):
+        try:
+            result = await self.client.request("user.info", {"handles": ";".join(handle for handle, future in batch)}, priority)
+        except Exception as e:
+            for handle, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if isinstance(result, int) or result["status"] != "OK":
+            # One unknown handle fails the whole request (400), so split the batch until it is isolated
+            if len(batch) > 1 and (result == 400 or isinstance(result, dict)):
+                middle = len(batch) // 2
+                await asyncio.gather(self._fetch(batch[:middle], priority), self._fetch(batch[middle:], priority))
+            else:
+                for handle, future in batch:
+                    if not future.done():
+                        future.set_result(result)
+            return
+
+        # Results come back in request order (a renamed handle returns its new name)
+        for (handle, future), profile in zip(batch, result["result"]):
+            self.put(profile, handle)
+            if not future.done():
+                future.set_result(profile)
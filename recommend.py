@@ -0,0 +1,213 @@
+# Problem recommendations
+# The catalog is turned into NumPy arrays once per catalog version: the rating, a tag bitmask and
+# the solved count of every rated problem. A user's history becomes two boolean masks over the same
+# rows (tried, solved), so scoring every problem against their rating and weakest tags is a handful
+# of array operations. Histories and results are cached per user until they submit something new,
+# which is noticed through the shared submission cache (verification.py).
+
+import asyncio
+import collections
+import json
+import logging
+import typing
+
+import numpy as np
+
+from cf_api import CodeforcesClient, PRIORITY_INTERACTIVE
+from problemset import JSONArrayStream, Problem, ProblemCatalog
+from profiles import ProfileCache
+from verification import SubmissionVerifier, PENDING_VERDICTS
+
+log = logging.getLogger(__name__)
+
+MAX_TAGS = 64 # Bits in the tag mask, Codeforces has about 40 tags
+RATING_SPREAD = 200 # Score halves about this far from the target rating
+UNRATED_RATING = 800 # Target for users with no rating and no rated solves
+
+# Arrays over every rated problem of one catalog version, row i is problems[i]
+class ProblemMatrix:
+    def __init__(self, catalog : ProblemCatalog):
+        self.version = (catalog.version, catalog.stats_version)
+        self.problems = [problem for problem in catalog.problems if problem.rating is not None]
+        self.rows = {(problem.contestId, problem.index): i for i, problem in enumerate(self.problems)}
+        count = len(self.problems)
+
+        self.tags = sorted(catalog.by_tag)[:MAX_TAGS]
+        if len(catalog.by_tag) > MAX_TAGS:
+            log.warning(f"Warning (RECOMMEND): {len(catalog.by_tag)} tags, only the first {MAX_TAGS} are used")
+        bits = {tag: 1 << i for i, tag in enumerate(self.tags)}
+
+        self.ratings = np.fromiter((problem.rating for problem in self.problems), dtype=np.float32, count=count)
+        self.tag_masks = np.fromiter((sum(bits.get(tag, 0) for tag in problem.tags) for problem in self.problems), dtype=np.uint64, count=count)
+        solved_counts = np.fromiter((catalog.solved_counts.get((problem.contestId, problem.index), 0) for problem in self.problems), dtype=np.float32, count=count)
+
+        # Derived once, so scoring is matrix products only
+        shifts = np.arange(len(self.tags), dtype=np.uint64)
+        self.tag_matrix = ((self.tag_masks[:, None] >> shifts) & np.uint64(1)).astype(np.float32) # problems x tags, 0/1
+        self.tag_counts = np.maximum(self.tag_matrix.sum(axis=1), 1)
+        self.tag_frequency = self.tag_matrix.mean(axis=0) if count else np.zeros(len(self.tags), dtype=np.float32)
+        self.popularity = np.log1p(solved_counts) / max(float(np.log1p(solved_counts.max())) if count else 0.0, 1.0) # 0..1
+
+    def tag_bit(self, tag : str) -> int:
+        return 1 << self.tags.index(tag) if tag in self.tags else 0
+
+    # Boolean mask of the rows of some (contestId, index) keys
+    def mask(self, keys : typing.Iterable[tuple]) -> np.ndarray:
+        mask = np.zeros(len(self.problems), dtype=bool)
+        rows = [self.rows[key] for key in keys if key in self.rows]
+        mask[rows] = True
+        return mask
+
+class Recommendation(typing.NamedTuple):
+    problems : list[Problem]
+    target : int # Rating aimed at
+    weak_tags : list[str] # Weakest first
+
+# What a user tried and solved, from their whole submission history
+class UserHistory:
+    __slots__ = ("tried", "solved", "high_water", "masks", "results")
+
+    def __init__(self):
+        self.tried = set() # (contestId, index)
+        self.solved = set()
+        self.high_water = 0 # Every submission with id <= this is included with its final verdict
+        self.masks = None # (matrix version, tried mask, solved mask)
+        self.results = {} # (matrix version, rating, count, tag) to Recommendation
+
+    # Adds submissions (newest first)
+    def add(self, submissions : list[tuple]):
+        if not submissions:
+            return
+        high_water = max(self.high_water, submissions[0][3])
+        for contestId, index, verdict, submissionId in submissions:
+            self.tried.add((contestId, index))
+            if verdict == "OK":
+                self.solved.add((contestId, index))
+            elif verdict in PENDING_VERDICTS:
+                high_water = min(high_water, submissionId - 1) # Seen again once judged
+        self.high_water = high_water
+        self.masks = None
+        self.results = {}
+
+    def masks_for(self, matrix : ProblemMatrix) -> tuple[np.ndarray, np.ndarray]:
+        if self.masks is None or self.masks[0] != matrix.version:
+            self.masks = (matrix.version, matrix.mask(self.tried), matrix.mask(self.solved))
+        return self.masks[1], self.masks[2]
+
+# Reads a user.status response keeping (contestId, index, verdict, id) of every submission
+async def parse_history(resp):
+    stream = JSONArrayStream(resp.content)
+    if not await stream.seek_array("result"):
+        return json.loads(stream.head + stream.buffer[stream.pos:])
+    return [(sub["problem"].get("contestId"), sub["problem"]["index"], sub.get("verdict"), sub["id"]) async for sub in stream.items()]
+
+def _brief(sub : dict) -> tuple:
+    return (sub["problem"].get("contestId"), sub["problem"]["index"], sub.get("verdict"), sub["id"])
+
+class Recommender:
+    def __init__(self, catalog : ProblemCatalog, profiles : ProfileCache, verifier : SubmissionVerifier, client : CodeforcesClient, max_users : int = 1000, stretch : int = 100):
+        self.catalog = catalog
+        self.profiles = profiles
+        self.verifier = verifier
+        self.client = client
+        self.max_users = max_users # Histories kept, least recently used are dropped first
+        self.stretch = stretch # Recommendations aim this far above the user's rating
+
+        self._matrix = None
+        self._users = collections.OrderedDict() # Lowercased handle to UserHistory
+        self._in_flight = {} # Lowercased handle to the Task fetching the whole history
+
+    def matrix(self) -> ProblemMatrix:
+        if self._matrix is None or self._matrix.version != (self.catalog.version, self.catalog.stats_version):
+            self._matrix = ProblemMatrix(self.catalog)
+        return self._matrix
+
+    async def _fetch_history(self, handle : str, priority : int):
+        result, headers = await self.client.request_conditional("user.status", {"handle": handle}, {}, priority, parse_history)
+        if not isinstance(result, list):
+            return result
+        history = UserHistory()
+        history.add(result)
+        return history
+
+    # The user's history, brought up to date with their newest submissions.
+    # If a request fails, the failed response is returned instead (status code, or the parsed json).
+    async def history(self, handle : str, priority : int = PRIORITY_INTERACTIVE) -> UserHistory | dict | int:
+        key = handle.lower()
+        history = self._users.get(key)
+        if history is not None:
+            recent = await self.verifier.recent_submissions(handle, priority=priority) # Shared with the other commands
+            if not isinstance(recent, list):
+                return recent
+            new = [sub for sub in recent if sub["id"] > history.high_water]
+            if new and len(new) == len(recent) and len(recent) >= self.verifier.window:
+                history = None # More new submissions than the cache holds, start over
+            else:
+                history.add([_brief(sub) for sub in new])
+
+        if history is None:
+            task = self._in_flight.get(key)
+            if task is None:
+                task = asyncio.create_task(self._fetch_history(handle, priority))
+                self._in_flight[key] = task
+                task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            history = await asyncio.shield(task)
+            if not isinstance(history, UserHistory):
+                return history
+
+        self._users[key] = history
+        self._users.move_to_end(key)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return history
+
+    # Recommends `count` unsolved problems (only ones with `tag`, if given) for a handle.
+    # If a request fails, the failed response is returned instead.
+    async def recommend(self, handle : str, count : int = 5, tag : str | None = None, priority : int = PRIORITY_INTERACTIVE) -> Recommendation | dict | int:
+        await self.catalog.ensure_loaded()
+        profile, history = await asyncio.gather(self.profiles.get(handle, priority), self.history(handle, priority))
+        if not isinstance(history, UserHistory):
+            return history
+        if not isinstance(profile, dict) or "status" in profile:
+            return profile
+
+        matrix = self.matrix()
+        key = (matrix.version, profile.get("rating"), count, tag)
+        if key not in history.results:
+            history.results[key] = self._score(matrix, history, profile.get("rating"), count, tag)
+        return history.results[key]
+
+    def _score(self, matrix : ProblemMatrix, history : UserHistory, rating : int | None, count : int, tag : str | None) -> Recommendation:
+        tried, solved = history.masks_for(matrix)
+        solved_any = solved.any()
+        if rating is None:
+            # Unrated: around the harder problems they already solve
+            rating = int(np.percentile(matrix.ratings[solved], 75)) if solved_any else UNRATED_RATING
+        target = round((rating + self.stretch) / 100) * 100
+
+        # Per tag: how often their attempts fail, and how little they practised it for how common it is
+        tried_per_tag = tried.astype(np.float32) @ matrix.tag_matrix
+        solved_per_tag = solved.astype(np.float32) @ matrix.tag_matrix
+        failure = 1 - (solved_per_tag + 1) / (tried_per_tag + 2)
+        share = solved_per_tag / max(float(solved_per_tag.sum()), 1.0)
+        neglect = np.clip(1 - share / np.maximum(matrix.tag_frequency, 1e-6), 0, 1)
+        weakness = 0.5 * failure + 0.5 * neglect
+
+        # Per problem: closeness to the target, mean weakness of its tags, and how many people solved it
+        fit = np.exp(-((matrix.ratings - target) / RATING_SPREAD) ** 2)
+        tag_score = (matrix.tag_matrix @ weakness) / matrix.tag_counts
+        score = fit * (0.5 + 0.5 * tag_score) * (0.75 + 0.25 * matrix.popularity)
+        score[solved] = 0
+        if tag is not None:
+            score[(matrix.tag_masks & np.uint64(matrix.tag_bit(tag))) == 0] = 0
+
+        count = min(count, len(score))
+        if count == 0:
+            return Recommendation([], target, [])
+        top = np.argpartition(-score, count - 1)[:count]
+        top = top[np.argsort(-score[top])]
+        problems = [matrix.problems[i] for i in top if score[i] > 0]
+
+        weak_order = np.argsort(-weakness)
+        weak_tags = [matrix.tags[i] for i in weak_order[:3]] if solved_any else []
+        return Recommendation(problems, target, weak_tags)
@@ -0,0 +1,102 @@
+# Handle registration
+# /register no longer sleeps for a minute inside the interaction. It saves a pending verification
+# and returns, and a background check looks at every pending handle together every few seconds.
+# Pending verifications live in the database, so they survive a restart.
+
+import asyncio
+import time
+import typing
+
+from cf_api import PRIORITY_INTERACTIVE
+from database import Database
+from verification import SubmissionVerifier
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS `pending_verification` (
+    `userID` INTEGER,
+    `codeforcesHandle` TEXT,
+    `problemContestID` INTEGER,
+    `problemIndex` TEXT,
+    `createdAt` REAL,
+    `expiresAt` REAL,
+    `channelID` INTEGER,
+    PRIMARY KEY(`userID`)
+)
+"""
+
+VERIFY_VERDICT = "COMPILATION_ERROR"
+
+class PendingVerification(typing.NamedTuple):
+    userID : int
+    handle : str
+    contestId : int
+    index : str
+    createdAt : float # Unix time
+    expiresAt : float # Unix time
+    channelID : int | None # Where to report back if the interaction is gone (e.g. after a restart)
+
+class RegistrationVerifier:
+    def __init__(self, db : Database, verifier : SubmissionVerifier, timeout : float = 60, poll_interval : float = 5):
+        self.db = db
+        self.verifier = verifier
+        self.timeout = timeout # Seconds the user has to submit
+        self.poll_interval = poll_interval # Seconds between checks
+
+        self.pending = {} # userID to PendingVerification
+
+    def __len__(self):
+        return len(self.pending)
+
+    async def load(self):
+        rows = await self.db.fetchall("SELECT userID, codeforcesHandle, problemContestID, problemIndex, createdAt, expiresAt, channelID FROM pending_verification")
+        self.pending = {row[0]: PendingVerification(*row) for row in rows}
+
+    # Starts (or restarts) the verification of a user, returns the pending record
+    async def begin(self, userID : int, handle : str, contestId : int, index : str, channelID : int | None) -> PendingVerification:
+        now = time.time()
+        pending = PendingVerification(userID, handle, contestId, index, now, now + self.timeout, channelID)
+        await self.db.execute("INSERT OR REPLACE INTO pending_verification(userID, codeforcesHandle, problemContestID, problemIndex, createdAt, expiresAt, channelID) VALUES(?, ?, ?, ?, ?, ?, ?)", pending)
+        self.pending[userID] = pending
+        return pending
+
+    async def _is_verified(self, pending : PendingVerification) -> bool:
+        # Slightly fresher than the poll interval, so every check sees new submissions
+        sub = await self.verifier.find_submission(pending.handle, pending.contestId, pending.index, VERIFY_VERDICT, self.poll_interval / 2, PRIORITY_INTERACTIVE)
+        if sub is None or isinstance(sub, int) or "status" in sub:
+            return False # Not submitted yet, or the API failed (retried next check)
+        return sub["creationTimeSeconds"] >= pending.createdAt - 5 # Submitted during this verification
+
+    # Checks every pending verification at once.
+    # Returns (verified, expired) lists of PendingVerification, both already removed.
+    async def check(self) -> tuple[list[PendingVerification], list[PendingVerification]]:
+        if not self.pending:
+            return ([], [])
+
+        pendings = list(self.pending.values())
+        results = await asyncio.gather(*(self._is_verified(pending) for pending in pendings))
+
+        now = time.time()
+        verified = [pending for pending, ok in zip(pendings, results) if ok]
+        expired = [pending for pending, ok in zip(pendings, results) if not ok and now >= pending.expiresAt]
+        if not verified and not expired:
+            return ([], [])
+
+        # Link the handles and drop finished verifications together.
+        # Rows are claimed by deleting them, so with several bot processes only one finishes each verification.
+        finished = verified + expired
+        async with self.db.transaction() as conn:
+            placeholders = ", ".join(["(?, ?)"] * len(finished))
+            async with conn.execute(f"DELETE FROM pending_verification WHERE (userID, createdAt) IN (VALUES {placeholders}) RETURNING userID, createdAt",
+                                    [value for pending in finished for value in (pending.userID, pending.createdAt)]) as cursor:
+                claimed = set(await cursor.fetchall())
+            verified = [pending for pending in verified if (pending.userID, pending.createdAt) in claimed]
+            expired = [pending for pending in expired if (pending.userID, pending.createdAt) in claimed]
+
+            await conn.executemany("INSERT INTO user_data(userID, codeforcesHandle, score) VALUES(?, ?, 0) ON CONFLICT(userID) DO UPDATE SET codeforcesHandle = excluded.codeforcesHandle",
+                                   [(pending.userID, pending.handle) for pending in verified])
+
+        for pending in finished:
+            if self.pending.get(pending.userID) == pending: # Not restarted meanwhile (or finished by another process)
+                del self.pending[pending.userID]
+
+        return (verified, expired)
@@ -0,0 +1,150 @@
+# Challenge scheduler
+# Posts each guild's challenge at its own time, in its own timezone. A heap of (fire time, guild)
+# entries is kept, and one task sleeps until the earliest is due, fires every guild due by then and
+# schedules their next day, so nothing ticks in between. Every guild is shifted by a fixed offset
+# inside a spread window, so guilds with the same post time don't hit Codeforces and Discord in the
+# same second. A guild whose slot passed while the bot was down is caught up (its latest day only).
+
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+import typing
+
+from database import Database
+from guild_settings import DEFAULT_SCOPE, GuildSettings
+
+log = logging.getLogger(__name__)
+
+MAX_SLEEP = 3600 # Seconds, wake up at least this often in case the wall clock jumped
+
+class ChallengeScheduler:
+    def __init__(self, settings : GuildSettings, spread : float = 300, retry_delay : float = 60):
+        self.settings = settings
+        self.spread = spread # Seconds guilds with the same post time are spread over
+        self.retry_delay = retry_delay # Seconds before a failed post is retried
+
+        self.last_posted = {} # Guild to the date of the latest challenge it was given
+        self._heap = [] # (fire time, guild), entries not matching _entries are stale
+        self._entries = {} # Guild to its live (fire time, date)
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, guild : int):
+        return guild in self._entries
+
+    # Loads the latest date every guild (and the shared challenge set) was posted
+    async def load(self, db : Database):
+        rows = await db.fetchall("SELECT guild, MAX(date) FROM challenge_broadcast GROUP BY guild")
+        rows += await db.fetchall("SELECT guild, MAX(date) FROM challenge_data WHERE guild = ?", (DEFAULT_SCOPE,))
+        self.last_posted = {}
+        for guild, date in rows:
+            if date is not None:
+                self.posted([int(guild)], datetime.date.fromisoformat(date))
+
+    # Records that guilds were given the challenge of a date
+    def posted(self, guilds : typing.Iterable[int], date : datetime.date):
+        for guild in guilds:
+            if guild not in self.last_posted or self.last_posted[guild] < date:
+                self.last_posted[guild] = date
+
+    # Date of the latest challenge a guild was given, the shared challenge's outside of guilds (or if it never had one)
+    def current_date(self, guild : int | None) -> datetime.date | None:
+        return self.last_posted.get(guild, self.last_posted.get(DEFAULT_SCOPE))
+
+    # Dates guilds are currently on (timezones put them at most a day apart)
+    def current_dates(self) -> set[datetime.date]:
+        if not self.last_posted:
+            return set()
+        oldest = max(self.last_posted.values()) - datetime.timedelta(days=1)
+        return {date for date in self.last_posted.values() if date >= oldest}
+
+    # Fixed per-guild delay inside the spread window (the shared set goes first)
+    def offset(self, guild : int) -> float:
+        return (guild * 2654435761 % 2**32) / 2**32 * self.spread
+
+    # Unix time of a guild's post time on a date, without the offset
+    def slot(self, guild : int, date : datetime.date) -> float:
+        config = self.settings.get(guild)
+        return datetime.datetime.combine(date, config.postTime, tzinfo=config.timezone).timestamp()
+
+    # Earliest post time of a date among the guilds given that date
+    def first_slot(self, date : datetime.date) -> float:
+        return min((self.slot(guild, date) for guild, posted in self.last_posted.items() if posted == date), default=self.slot(DEFAULT_SCOPE, date))
+
+    # (fire time, date) of a guild's next post: right away if it missed its latest slot, otherwise its next slot
+    def _next(self, guild : int, now : float) -> tuple[float, datetime.date]:
+        config = self.settings.get(guild)
+        offset = self.offset(guild)
+        date = datetime.datetime.fromtimestamp(now, config.timezone).date()
+        if self.slot(guild, date) + offset > now:
+            date -= datetime.timedelta(days=1) # Latest slot that already passed
+
+        last = self.last_posted.get(guild)
+        if last is not None and last < date:
+            return (now + offset, date) # Missed while the bot was down
+
+        date = max(date, last or date) + datetime.timedelta(days=1)
+        return (self.slot(guild, date) + offset, date)
+
+    # Puts a guild on the heap (replacing its previous entry), at its next slot unless a time is given
+    def schedule(self, guild : int, fire_time : float | None = None, date : datetime.date | None = None):
+        if fire_time is None:
+            fire_time, date = self._next(guild, time.time())
+        elif date is None:
+            date = datetime.datetime.fromtimestamp(fire_time, self.settings.get(guild).timezone).date()
+
+        self._entries[guild] = (fire_time, date)
+        heapq.heappush(self._heap, (fire_time, guild))
+        self._wakeup.set()
+
+    # Ends a pending wait() early, e.g. so the loop around it can stop
+    def wake(self):
+        self._wakeup.set()
+
+    def unschedule(self, guild : int):
+        self._entries.pop(guild, None)
+
+    # Pops every guild due by now and passes them to fire() as [(guild, date)].
+    # fire() should call posted() once their challenge is saved. Returns the number of guilds fired.
+    async def run_due(self, fire : typing.Callable[[list[tuple[int, datetime.date]]], typing.Awaitable]) -> int:
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_time, guild = heapq.heappop(self._heap)
+            entry = self._entries.get(guild)
+            if entry is None or entry[0] != fire_time:
+                continue # Rescheduled or unscheduled since
+            due.append((guild, entry[1]))
+
+        if not due:
+            return 0
+
+        try:
+            await fire(due)
+        except Exception as e:
+            log.error(f"Error (SCHEDULER): posting the challenge to {len(due)} guilds failed, retrying in {self.retry_delay}s: {e!r}")
+            retry_at = time.time() + self.retry_delay
+        else:
+            retry_at = None
+
+        # Next day (or a retry), unless the guild was rescheduled or removed meanwhile
+        for guild, date in due:
+            entry = self._entries.get(guild)
+            if entry is not None and entry[1] == date:
+                self.schedule(guild, retry_at, date if retry_at is not None else None)
+        return len(due)
+
+    # Sleeps until the earliest entry is due, or until the schedule changes
+    async def wait(self):
+        self._wakeup.clear()
+        timeout = min(self._heap[0][0] - time.time(), MAX_SLEEP) if self._heap else MAX_SLEEP
+        if timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,29 @@
+# Challenge scoring
+# Shared by /complete_challenge and the automatic contest poller, so both credit the same way.
+# Every credit is appended to the score ledger (ledger.py) along with the user's score.
+
+import datetime
+
+from ledger import Completion, append as append_completions
+
+def get_scoring(rating : int) -> int:
+    return 10 + (rating-800)//100
+
+# Credits challenge completions of one date inside the caller's transaction.
+# completions is a dict of {userID: Completion}. Users who already completed a challenge on (or after)
+# that date are skipped, and the ledger's primary key rejects a second row for the same date,
+# so crediting twice is a no-op.
+# Returns a dict of {userID: points} for the users that were credited.
+async def credit_challenges(conn, date : datetime.date, completions : dict[int, Completion]) -> dict[int, int]:
+    if not completions:
+        return {}
+
+    user_ids = list(completions)
+    placeholders = ", ".join("?" * len(user_ids))
+    async with conn.execute(f"SELECT userID FROM user_data WHERE userID IN ({placeholders}) AND (lastChallengeDate IS NULL OR lastChallengeDate < ?)", (*user_ids, date.isoformat())) as cursor:
+        eligible = [row[0] for row in await cursor.fetchall()]
+
+    credited = await append_completions(conn, date, {userID: (completions[userID], get_scoring(completions[userID].rating)) for userID in eligible})
+    await conn.executemany("UPDATE user_data SET score = score + ?, lastChallengeDate = ? WHERE userID = ?",
+                           [(points, date.isoformat(), userID) for userID, points in credited.items()])
+    return credited
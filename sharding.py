@@ -0,0 +1,41 @@
+# Sharding
+# The bot can run as one process, as one process with every shard (AutoShardedInteractionBot),
+# or as several processes that each run some of the shards. Discord puts a guild on shard
+# (guild_id >> 22) % shard_count, so a process only schedules and resumes posts of its own guilds.
+
+import os
+
+class ShardConfig:
+    def __init__(self, shard_count : int | None = None, shard_ids : list[int] | None = None):
+        self.shard_count = shard_count # None when not sharded
+        self.shard_ids = shard_ids # Shards this process runs, None for all of them
+
+    # Reads SHARD_COUNT and SHARD_IDS (comma-separated) from the environment
+    @classmethod
+    def from_env(cls) -> "ShardConfig":
+        count = os.environ.get("SHARD_COUNT")
+        ids = os.environ.get("SHARD_IDS")
+        shard_count = int(count) if count else None
+        shard_ids = [int(shard) for shard in ids.split(",") if shard.strip()] if ids and shard_count else None
+        return cls(shard_count, shard_ids)
+
+    # Whether other processes run the remaining shards
+    @property
+    def partial(self) -> bool:
+        return self.shard_ids is not None and len(set(self.shard_ids)) < self.shard_count
+
+    def shard_of(self, guild : int) -> int:
+        return (guild >> 22) % self.shard_count if self.shard_count else 0
+
+    # Whether this process runs the guild's shard
+    def owns(self, guild : int) -> bool:
+        return self.shard_ids is None or self.shard_of(guild) in self.shard_ids
+
+    # Keyword arguments for the bot's constructor
+    def bot_kwargs(self) -> dict:
+        if self.shard_count is None:
+            return {}
+        kwargs = {"shard_count": self.shard_count}
+        if self.shard_ids is not None:
+            kwargs["shard_ids"] = self.shard_ids
+        return kwargs
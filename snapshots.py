@@ -0,0 +1,37 @@
+# Snapshots
+# In-memory caches are written to JSON files on shutdown and read back on the next start, so a
+# restart doesn't begin with cold caches. Files are written to a temporary name and renamed, so a
+# crash mid-write leaves the previous snapshot intact. Reading and writing happen in a thread.
+
+import asyncio
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+def _write(path : str, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp = f"{path}.tmp"
+    with open(temp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(temp, path)
+
+def _read(path : str):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+async def write(path : str, data):
+    await asyncio.to_thread(_write, path, data)
+
+# The snapshot's data, or None if there is none (or it can't be read)
+async def read(path : str):
+    try:
+        return await asyncio.to_thread(_read, path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning(f"Warning (SNAPSHOT): ignoring unreadable snapshot {path}: {e!r}")
+        return None
@@ -0,0 +1,122 @@
+# Submission verification
+# Shared cache of every handle's recent submissions, used to check "did X get verdict Y on problem Z".
+# Concurrent checks of the same handle share one user.status request, results are reused for a
+# short TTL, and a refresh only pages back until the newest submission already seen.
+
+import asyncio
+import collections
+import time
+
+from cf_api import CodeforcesClient, PRIORITY_INTERACTIVE
+
+PENDING_VERDICTS = (None, "TESTING") # Submission still being judged
+
+class HandleSubmissions:
+    __slots__ = ("submissions", "by_problem", "high_water", "fetched_at")
+
+    def __init__(self):
+        self.submissions = [] # Newest first
+        self.by_problem = {} # (contestId, index, verdict) to the newest submission with that verdict
+        self.high_water = 0 # Every submission with id <= this is cached with its final verdict
+        self.fetched_at = 0.0 # time.monotonic() of the last fetch
+
+    # Merges newly fetched submissions (newest first) and keeps the newest `window` ones
+    def merge(self, fetched : list[dict], window : int):
+        fetched_ids = {sub["id"] for sub in fetched}
+        self.submissions = fetched + [sub for sub in self.submissions if sub["id"] not in fetched_ids]
+        del self.submissions[window:]
+
+        self.by_problem = {}
+        for sub in reversed(self.submissions): # Oldest first, so newer submissions overwrite
+            problem = sub["problem"]
+            self.by_problem[(problem.get("contestId"), problem["index"], sub.get("verdict"))] = sub
+
+        # Anything still being judged has to be fetched again, so the mark stays below it
+        self.high_water = self.submissions[0]["id"] if self.submissions else 0
+        for sub in self.submissions:
+            if sub.get("verdict") in PENDING_VERDICTS:
+                self.high_water = min(self.high_water, sub["id"] - 1)
+
+class SubmissionVerifier:
+    def __init__(self, client : CodeforcesClient, ttl : float = 5, window : int = 100, page_size : int = 10, max_pages : int = 5, max_handles : int = 10000):
+        self.client = client
+        self.ttl = ttl # Seconds a fetch is reused for
+        self.window = window # Submissions kept per handle
+        self.page_size = page_size # Submissions per request when refreshing
+        self.max_pages = max_pages # Pages to look back before giving up on the high-water mark
+        self.max_handles = max_handles
+
+        self._cache = collections.OrderedDict() # Lowercased handle to HandleSubmissions, least recently used first
+        self._in_flight = {} # Lowercased handle to the Task fetching it
+
+    # Returns the cached submissions of a handle (newest first), refreshing them if older than max_age.
+    # If the request fails, the failed response is returned instead (status code, or the parsed json).
+    async def recent_submissions(self, handle : str, max_age : float | None = None, priority : int = PRIORITY_INTERACTIVE) -> list[dict] | dict | int:
+        key = handle.lower()
+        entry = self._cache.get(key)
+        if max_age is None:
+            max_age = self.ttl
+
+        if entry is not None and time.monotonic() - entry.fetched_at < max_age:
+            self._cache.move_to_end(key)
+            return entry.submissions
+
+        # Only one request per handle at a time, everybody else waits for the same one
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(handle, key, priority))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    # Finds the newest submission of a handle to a problem with the given verdict.
+    # Returns the submission, None if there isn't one, or the failed response like recent_submissions.
+    async def find_submission(self, handle : str, contestId : int, index : str, verdict : str = "OK", max_age : float | None = None, priority : int = PRIORITY_INTERACTIVE) -> dict | int | None:
+        entry = self._cache.get(handle.lower())
+        if entry is not None and (contestId, index, verdict) in entry.by_problem:
+            return entry.by_problem[(contestId, index, verdict)] # Verdicts found are final, no need to refetch
+
+        result = await self.recent_submissions(handle, max_age, priority)
+        if not isinstance(result, list):
+            return result
+
+        entry = self._cache.get(handle.lower())
+        return None if entry is None else entry.by_problem.get((contestId, index, verdict))
+
+    async def _refresh(self, handle, key, priority):
+        entry = self._cache.get(key)
+
+        if entry is None or entry.high_water == 0:
+            # Nothing known yet, a single page of the whole window
+            result = await self.client.request("user.status", {"handle": handle, "from": 1, "count": self.window}, priority)
+            if isinstance(result, int) or result["status"] != "OK":
+                return result
+            fetched = result["result"]
+            entry = HandleSubmissions()
+        else:
+            # Page back until the high-water mark
+            fetched = []
+            reached = False
+            for page in range(self.max_pages):
+                result = await self.client.request("user.status", {"handle": handle, "from": 1 + page * self.page_size, "count": self.page_size}, priority)
+                if isinstance(result, int) or result["status"] != "OK":
+                    return result
+
+                page_subs = result["result"]
+                fetched += page_subs
+                if len(page_subs) < self.page_size or page_subs[-1]["id"] <= entry.high_water:
+                    reached = True
+                    break
+
+            if not reached:
+                entry = HandleSubmissions() # Too many new submissions, the old ones are no longer contiguous
+
+        entry.merge(fetched, self.window)
+        entry.fetched_at = time.monotonic()
+
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_handles:
+            self._cache.popitem(last=False)
+
+        return entry.submissions